@@ -1,8 +1,7 @@
 import os
-from project import application, db
+from project import create_app
 
-with application.app_context():
-    db.create_all()
+application = create_app()
 
 if __name__=='__main__':
-    application.run(debug=True, host="0.0.0.0", port=int(os.envion.get("PORT",8080)))
+    application.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT",8080)))
@@ -0,0 +1,100 @@
+'''
+Overloads a two connection pool with slow requests from many clients and
+measures the latency of a cheap endpoint with admission control off and on.
+
+    python -m benchmarks.bench_admission [seconds] [clients]
+'''
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import text
+
+from project import create_app, db
+from project.models import Teacher, Student, Enrollment, Class
+
+STUDENTS = 25
+SLOW_QUERY_SECONDS = 0.05
+
+
+def seed():
+    db.create_all()
+    teacher = Teacher(first_name='Bench', last_name='Mark', email='bench@example.com', password='password')
+    class_ = Class(name='Bench 101', school_year='2022-2023', teacher=teacher)
+    students = [Student(first_name=f'First{i}', last_name=f'Last{i}') for i in range(STUDENTS)]
+    db.session.add_all([teacher, class_] + students)
+    db.session.flush()
+    db.session.add_all([Enrollment(student_id=student.id, class_id=class_.id) for student in students])
+    db.session.commit()
+    return class_.id
+
+
+def slow_report():
+    # Stands in for a heavy report, holds its connection the whole time
+    db.session.execute(text('SELECT 1'))
+    time.sleep(SLOW_QUERY_SECONDS)
+    return {"ok": True}
+
+
+def run(path, enabled, seconds, clients):
+    application = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {'pool_size': 2, 'max_overflow': 0, 'pool_timeout': 60},
+        'ADMISSION_ENABLED': enabled,
+    })
+    application.add_url_rule('/bench/slow', 'bench_slow', slow_report)
+    with application.app_context():
+        db.drop_all()
+        class_id = seed()
+
+    statuses = {}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def client(number):
+        test_client = application.test_client()
+        environ = {'REMOTE_ADDR': f'10.0.0.{number}'}
+        while time.monotonic() < stop:
+            status = test_client.get('/bench/slow', environ_base=environ).status_code
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+
+    latencies = []
+    probe = application.test_client()
+    while time.monotonic() < stop:
+        start = time.perf_counter()
+        probe.get(f'/class/{class_id}/students', environ_base={'REMOTE_ADDR': '10.0.1.1'})
+        latencies.append((time.perf_counter() - start) * 1000)
+        time.sleep(0.02)
+
+    for thread in threads:
+        thread.join()
+    with application.app_context():
+        db.engine.dispose()
+    latencies.sort()
+    return latencies, statuses
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        print(f'{clients} clients on /bench/slow for {seconds:g}s, 2 pooled connections')
+        print(f'{"admission":<12}{"probes":>8}{"p50 ms":>10}{"p99 ms":>10}  slow route statuses')
+        for enabled in (False, True):
+            latencies, statuses = run(path, enabled, seconds, clients)
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            print(f'{"on" if enabled else "off":<12}{len(latencies):>8}{statistics.median(latencies):>10.1f}'
+                  f'{p99:>10.1f}  {dict(sorted(statuses.items()))}')
+
+
+if __name__ == '__main__':
+    main()
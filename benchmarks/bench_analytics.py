@@ -0,0 +1,153 @@
+'''
+Times loading grades from a SQLite table into NumPy columns (time and
+peak memory, next to fetching every row first), then the vectorized
+statistics on synthetic columns from 10k up to millions of grades, next
+to a plain Python loop for the smaller sizes.
+
+    python -m benchmarks.bench_analytics [max_grades] [max_loaded_grades]
+'''
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+import numpy as np
+
+from project import create_app, db
+from project.adapted.analytics import (
+    GradeColumns, SUBJECTS, SUBJECT_CODES, load_grade_columns, percentile_ranks, rolling_averages,
+    school_grade_query, student_means, subject_distributions, z_scores)
+from project.adapted.sharding import DEFAULT_SHARD, use_shard
+from project.models import Grade, GradeType
+
+LOOP_LIMIT = 200000
+INSERT_BATCH_SIZE = 50000
+
+
+def synthetic_columns(n, grades_per_student=60, seed=0):
+    rng = np.random.default_rng(seed)
+    n_students = max(1, n // grades_per_student)
+    return GradeColumns(
+        np.arange(n, dtype=np.int64),
+        rng.integers(0, n_students, n, dtype=np.int64),
+        rng.integers(0, len(SUBJECTS), n, dtype=np.int8),
+        np.datetime64('2022-08-01') + rng.integers(0, 365, n).astype('timedelta64[D]'),
+        rng.uniform(40, 100, n),
+    )
+
+
+def vectorized(columns):
+    student_ids, counts, means = student_means(columns)
+    percentile_ranks(means)
+    z_scores(means)
+    rolling_averages(columns)
+    subject_distributions(columns)
+
+
+# Roughly what a per-object implementation in the views would do
+def python_loop(columns, window=3):
+    rows = list(zip(columns.grade_id.tolist(), columns.student_id.tolist(), columns.subject.tolist(),
+                    columns.date.tolist(), columns.grade_value.tolist()))
+    by_student = {}
+    for row in rows:
+        by_student.setdefault(row[1], []).append(row[4])
+    means = {student_id: sum(values) / len(values) for student_id, values in by_student.items()}
+    ordered = sorted(means.values())
+    for mean in means.values():
+        sum(1 for other in ordered if other < mean)
+    groups = {}
+    for row in sorted(rows, key=lambda row: (row[1], row[2], row[3], row[0])):
+        history = groups.setdefault((row[1], row[2]), [])
+        history.append(row[4])
+        sum(history[-window:]) / len(history[-window:])
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def best_of(fn, *args, repeat=3):
+    return min(timed(fn, *args) for _ in range(repeat))
+
+
+def peak_mib(fn, *args):
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+# How load_grade_columns used to work, every row is fetched before the arrays
+def rows_then_arrays(statement):
+    rows = db.session.execute(statement).all()
+    grade_ids, student_ids, subjects, dates, values = zip(*rows)
+    n = len(rows)
+    return GradeColumns(
+        np.fromiter(grade_ids, np.int64, n),
+        np.fromiter(student_ids, np.int64, n),
+        np.fromiter((SUBJECT_CODES.get(subject, -1) for subject in subjects), np.int8, n),
+        np.array(dates, dtype='datetime64[D]'),
+        np.fromiter(values, np.float64, n),
+    )
+
+
+def insert_grades(start, stop, grades_per_student=60):
+    first_day = date(2022, 8, 1)
+    for offset in range(start, stop, INSERT_BATCH_SIZE):
+        db.session.execute(db.insert(Grade.__table__), [{
+            "student_id": i // grades_per_student + 1, "grade_type": GradeType.QUIZ.name,
+            "grade_value": 40 + i % 60, "date": first_day + timedelta(days=i % 365),
+            "subject": SUBJECTS[i % len(SUBJECTS)].name
+        } for i in range(offset, min(stop, offset + INSERT_BATCH_SIZE))])
+    db.session.commit()
+
+
+def bench_loading(max_grades):
+    sizes = [n for n in (10000, 100000, 1000000) if n <= max_grades]
+    statement = school_grade_query('2022-2023')
+    print(f'{"grades":>10}{"load ms":>10}{"grades/s":>14}{"peak MiB":>10}'
+          f'{"all rows ms":>14}{"peak MiB":>10}')
+    with tempfile.TemporaryDirectory() as directory:
+        application = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(directory, "bench.db")}'})
+        with application.app_context(), use_shard(DEFAULT_SHARD):
+            db.create_all()
+            # Compiles and caches both statements before anything is timed
+            load_grade_columns(statement)
+            db.session.execute(statement).all()
+            loaded = 0
+            for n in sizes:
+                insert_grades(loaded, n)
+                loaded = n
+                load_time = best_of(load_grade_columns, statement)
+                load_peak = peak_mib(load_grade_columns, statement)
+                rows_time = best_of(rows_then_arrays, statement)
+                rows_peak = peak_mib(rows_then_arrays, statement)
+                print(f'{n:>10}{load_time * 1000:>10.1f}{n / load_time:>14,.0f}{load_peak:>10.1f}'
+                      f'{rows_time * 1000:>14.1f}{rows_peak:>10.1f}')
+            db.session.remove()
+
+
+def main():
+    max_grades = int(sys.argv[1]) if len(sys.argv) > 1 else 5000000
+    max_loaded_grades = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    bench_loading(max_loaded_grades)
+    print()
+
+    sizes = [n for n in (10000, 100000, 1000000, 5000000, 10000000) if n <= max_grades]
+
+    print(f'{"grades":>10}{"vectorized ms":>16}{"python loop ms":>17}{"grades/s":>16}')
+    for n in sizes:
+        columns = synthetic_columns(n)
+        vector_time = timed(vectorized, columns)
+        loop = f'{timed(python_loop, columns) * 1000:>17.1f}' if n <= LOOP_LIMIT else f'{"-":>17}'
+        print(f'{n:>10}{vector_time * 1000:>16.1f}{loop}{n / vector_time:>16,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+'''
+Reports bytes-on-wire and encode CPU for every body encoding and
+content encoding on a synthetic class_grades payload.
+
+    python -m benchmarks.bench_encoding [students] [grades_per_student]
+'''
+import gzip
+import json
+import sys
+import time
+from datetime import date, timedelta
+from random import randrange, choice
+
+from werkzeug.http import http_date
+
+from project.adapted.compression import to_columnar, encode_msgpack, brotli, msgpack
+from project.models import GradeType, SubjectType
+
+
+def build_payload(n_students, n_grades):
+    students = []
+    grade_id = 1
+    for student_id in range(1, n_students + 1):
+        grades = []
+        for i in range(n_grades):
+            grades.append({
+                "id": grade_id,
+                "subject": str(choice(list(SubjectType))),
+                "grade_type": str(choice(list(GradeType))),
+                "date": date(2022, 9, 1) + timedelta(days=i),
+                "grade_value": float(randrange(50, 100))
+            })
+            grade_id += 1
+        students.append({
+            "id": student_id,
+            "first_name": f"First{student_id}",
+            "last_name": f"Last{student_id}",
+            "grades": grades
+        })
+    return {"Class": {"id": 1, "students": students}}
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return http_date(value)
+    raise TypeError(f'Cannot serialize {type(value)}')
+
+
+def timed(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        result = fn()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    n_students = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    n_grades = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    payload = build_payload(n_students, n_grades)
+
+    body_encodings = {
+        'json': lambda: json.dumps(payload, default=_json_default).encode(),
+        'columnar-json': lambda: json.dumps(to_columnar(payload), default=_json_default).encode(),
+    }
+    if msgpack is not None:
+        body_encodings['msgpack'] = lambda: encode_msgpack(payload)
+
+    content_encodings = {
+        'identity': lambda data: data,
+        'gzip': lambda data: gzip.compress(data, compresslevel=6),
+    }
+    if brotli is not None:
+        content_encodings['br'] = lambda data: brotli.compress(data, quality=4)
+
+    print(f'{n_students} students x {n_grades} grades')
+    print(f'{"format":<16}{"encoding":<10}{"bytes":>12}{"encode ms":>12}{"compress ms":>14}')
+    for name, encode in body_encodings.items():
+        body, encode_time = timed(encode)
+        for encoding, compress in content_encodings.items():
+            wire, compress_time = timed(lambda: compress(body))
+            print(f'{name:<16}{encoding:<10}{len(wire):>12}{encode_time * 1000:>12.2f}{compress_time * 1000:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
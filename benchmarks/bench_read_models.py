@@ -0,0 +1,117 @@
+'''
+Compares the old ORM path with the read models on 10k-row lesson plan
+and gradebook responses, reporting CPU time and peak allocated memory per row.
+
+    python -m benchmarks.bench_read_models [rows]
+'''
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from project import create_app, db
+from project.adapted.read_models import class_lesson_plans, enrolled_students, grades_by_student
+from project.models import Teacher, Student, Enrollment, Class, LessonPlan, Grade, GradeType, SubjectType
+
+STUDENTS = 25
+
+
+def seed(rows):
+    db.create_all()
+    teacher = Teacher(first_name='Bench', last_name='Mark', email='bench@example.com', password='password')
+    class_ = Class(name='Bench 101', school_year='2022-2023', teacher=teacher)
+    students = [Student(first_name=f'First{i}', last_name=f'Last{i}') for i in range(STUDENTS)]
+    db.session.add_all([teacher, class_] + students)
+    db.session.flush()
+    db.session.add_all([Enrollment(student_id=student.id, class_id=class_.id) for student in students])
+
+    start = date(2022, 9, 1)
+    # Table inserts, the sharded session can't run ORM bulk inserts
+    db.session.execute(db.insert(LessonPlan.__table__), [{
+        "class_id": class_.id, "name": f'Lesson {i}', "date": start + timedelta(days=i % 300),
+        "overview": 'Overview ' * 10, "objective": 'Objective ' * 10, "subject": SubjectType.MATH
+    } for i in range(rows)])
+    db.session.execute(db.insert(Grade.__table__), [{
+        "student_id": students[i % STUDENTS].id, "grade_type": GradeType.QUIZ, "grade_value": 50 + i % 50,
+        "date": start + timedelta(days=i % 300), "subject": SubjectType.MATH
+    } for i in range(rows)])
+    db.session.commit()
+    return class_.id
+
+
+def orm_lesson_plans(class_id):
+    return [{
+        "id": lesson_plan.id,
+        "name": lesson_plan.name,
+        "date": lesson_plan.date,
+        "overview": lesson_plan.overview,
+        "objective": lesson_plan.objective,
+        "subject": str(lesson_plan.subject)
+    } for lesson_plan in LessonPlan.query.filter_by(class_id=class_id).all()]
+
+
+def read_model_lesson_plans(class_id):
+    return [lesson_plan.to_json() for lesson_plan in class_lesson_plans(class_id)]
+
+
+def orm_grades(class_id):
+    students = []
+    for enrollment in Enrollment.query.filter_by(class_id=class_id).all():
+        student = db.session.get(Student, enrollment.student_id)
+        students.append({
+            "id": student.id,
+            "grades": [{
+                "id": grade.id,
+                "subject": str(grade.subject),
+                "grade_type": str(grade.grade_type),
+                "date": grade.date,
+                "grade_value": grade.grade_value
+            } for grade in Grade.query.filter_by(student_id=student.id).all()]
+        })
+    return students
+
+
+def read_model_grades(class_id):
+    enrolled = enrolled_students(class_id)
+    grades = grades_by_student([student.id for student in enrolled], '2022-2023')
+    return [{
+        "id": student.id,
+        "grades": grades[student.id]
+    } for student in enrolled]
+
+
+def measure(fn, class_id, repeat=5):
+    best = None
+    for _ in range(repeat):
+        # Fresh session each time so the ORM path can't reuse its identity map
+        db.session.remove()
+        start = time.process_time()
+        fn(class_id)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    db.session.remove()
+    tracemalloc.start()
+    fn(class_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    application = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with application.app_context():
+        class_id = seed(rows)
+        print(f'{rows} rows')
+        print(f'{"path":<26}{"cpu ms":>10}{"us/row":>10}{"peak KiB":>12}{"bytes/row":>12}')
+        for name, fn in (('orm lesson_plans', orm_lesson_plans),
+                         ('read model lesson_plans', read_model_lesson_plans),
+                         ('orm grades', orm_grades),
+                         ('read model grades', read_model_grades)):
+            cpu, peak = measure(fn, class_id)
+            print(f'{name:<26}{cpu * 1000:>10.1f}{cpu * 1e6 / rows:>10.2f}{peak / 1024:>12.0f}{peak / rows:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
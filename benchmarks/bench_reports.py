@@ -0,0 +1,87 @@
+'''
+Report card throughput for a synthetic school year: the bulk prefetch
+(queries and time), then rendering into a zip with one process and with
+a process pool.
+
+    python -m benchmarks.bench_reports [students] [workers]
+'''
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import event
+
+from project import create_app, db
+from project.adapted.reports import load_report_cards, stream_report_cards
+from project.models import (
+    Teacher, Student, IEP, Enrollment, Class, LessonPlan, Grade, Accommodation, GradeType, SubjectType)
+
+GRADES_PER_STUDENT = 40
+STUDENTS_PER_CLASS = 25
+LESSON_PLANS_PER_CLASS = 20
+
+
+def seed(students):
+    db.create_all()
+    start = date(2022, 9, 1)
+    n_classes = max(1, students // STUDENTS_PER_CLASS)
+    # Table inserts, the sharded session can't run ORM bulk inserts
+    db.session.execute(db.insert(Teacher.__table__), [{
+        "first_name": f'Teacher{i}', "last_name": 'Bench', "email": f'teacher{i}@example.com', "password": 'password'
+    } for i in range(n_classes)])
+    db.session.execute(db.insert(Class.__table__), [{
+        "teacher_id": i + 1, "name": f'Class {i}', "school_year": '2022-2023'
+    } for i in range(n_classes)])
+    db.session.execute(db.insert(Student.__table__), [{
+        "first_name": f'First{i}', "last_name": f'Last{i}'
+    } for i in range(students)])
+    db.session.execute(db.insert(Enrollment.__table__), [{
+        "student_id": i + 1, "class_id": i % n_classes + 1
+    } for i in range(students)])
+    db.session.execute(db.insert(Grade.__table__), [{
+        "student_id": i % students + 1, "grade_type": GradeType.QUIZ, "grade_value": 50 + i % 50,
+        "date": start + timedelta(days=i % 250), "subject": list(SubjectType)[i % 2]
+    } for i in range(students * GRADES_PER_STUDENT)])
+    db.session.execute(db.insert(IEP.__table__), [{
+        "student_id": i + 1, "description": 'Extended time', "disability": 'ADHD', "start_date": start
+    } for i in range(0, students, 5)])
+    db.session.execute(db.insert(LessonPlan.__table__), [{
+        "class_id": i % n_classes + 1, "name": f'Lesson {i}', "date": start + timedelta(days=i % 250),
+        "overview": 'Overview', "objective": 'Objective', "subject": SubjectType.MATH
+    } for i in range(n_classes * LESSON_PLANS_PER_CLASS)])
+    db.session.execute(db.insert(Accommodation.__table__), [{
+        "student_id": i + 1, "lesson_plan_id": i % n_classes + 1, "text": 'Read questions aloud'
+    } for i in range(0, students, 5)])
+    db.session.commit()
+
+
+def render(cards, workers):
+    start = time.perf_counter()
+    size = sum(len(chunk) for chunk in stream_report_cards(cards, 'html', workers))
+    return time.perf_counter() - start, size
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else max(2, os.cpu_count() or 1)
+    application = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    with application.app_context():
+        seed(students)
+        queries = []
+        event.listen(db.engine, 'before_cursor_execute', lambda *args: queries.append(1))
+        start = time.perf_counter()
+        cards = load_report_cards('2022-2023')
+        prefetch = time.perf_counter() - start
+
+    print(f'{len(cards)} students, {GRADES_PER_STUDENT} grades each')
+    print(f'prefetch: {len(queries)} queries, {prefetch * 1000:.0f} ms')
+    print(f'{"workers":<10}{"seconds":>10}{"reports/s":>12}{"zip KiB":>10}')
+    for count in (1, workers):
+        elapsed, size = render(cards, count)
+        print(f'{count:<10}{elapsed:>10.2f}{len(cards) / elapsed:>12.0f}{size / 1024:>10.0f}')
+    print(f'{os.cpu_count()} CPUs available')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+'''
+Concurrent grade writes spread over three schools, with every school on
+one database and with each school on its own shard. Then times the
+district analytics scatter-gather and checks each grade landed on its
+school's shard.
+
+    python -m benchmarks.bench_sharding [seconds] [clients]
+'''
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from project import create_app, db
+from project.adapted.sharding import SCHOOL_HEADER, create_all_shards, shard_engines, use_shard
+from project.models import Teacher, Student, Enrollment, Class, Grade
+
+SCHOOLS = (1, 2, 3)
+STUDENTS = 25
+
+
+def seed(application):
+    # Same ids on every shard, only the school tells them apart
+    router = application.extensions['sharding']
+    student_ids = {}
+    with application.app_context():
+        create_all_shards()
+        for school_id in SCHOOLS:
+            shard = router.shard_for_school(school_id)
+            with use_shard(shard):
+                teacher = Teacher(first_name='Bench', last_name=f'School{school_id}', school_id=school_id,
+                                  email=f'bench{school_id}@example.com', password='password')
+                class_ = Class(name=f'Bench {school_id}', school_year='2022-2023', teacher=teacher,
+                               school_id=school_id)
+                students = [Student(first_name=f'First{i}', last_name=f'Last{i}', school_id=school_id)
+                            for i in range(STUDENTS)]
+                db.session.add_all([teacher, class_] + students)
+                db.session.flush()
+                db.session.add_all([Enrollment(student_id=student.id, class_id=class_.id) for student in students])
+                db.session.commit()
+                student_ids[school_id] = [student.id for student in students]
+        db.session.remove()
+    return student_ids
+
+
+def run(directory, sharded, seconds, clients):
+    shards = {f'shard_{i}': f'sqlite:///{os.path.join(directory, f"shard_{i}.db")}' for i in (1, 2)}
+    application = create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(directory, "default.db")}',
+        'SHARDS': shards if sharded else {},
+        'SHARD_SCHOOLS': {2: 'shard_1', 3: 'shard_2'} if sharded else {},
+        'ADMISSION_ENABLED': False,
+    })
+    student_ids = seed(application)
+
+    writes = [0]
+    errors = {}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def client(number):
+        test_client = application.test_client()
+        school_id = SCHOOLS[number % len(SCHOOLS)]
+        body = {'student_id': student_ids[school_id][number % STUDENTS], 'grade_type': 'Quiz', 'grade_value': 90,
+                'date': '2022-10-01', 'subject': 'Math'}
+        while time.monotonic() < stop:
+            status = test_client.post('/grade', json=body, headers={SCHOOL_HEADER: school_id}).status_code
+            with lock:
+                if status in (200, 204):
+                    writes[0] += 1
+                else:
+                    errors[status] = errors.get(status, 0) + 1
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    test_client = application.test_client()
+    # Warms up the first request, a school year with no grades
+    test_client.get('/admin/analytics/2021-2022')
+    start = time.perf_counter()
+    status = test_client.get('/admin/analytics/2022-2023').status_code
+    analytics = (time.perf_counter() - start) * 1000
+
+    with application.app_context():
+        placement = {}
+        for shard, engine in shard_engines().items():
+            with engine.connect() as connection:
+                placement[shard] = dict(connection.execute(
+                    select(Student.school_id, func.count(Grade.id))
+                    .join(Grade, Grade.student_id == Student.id)
+                    .group_by(Student.school_id)).all())
+            engine.dispose()
+    return writes[0], errors, status, analytics, placement
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    clients = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    print(f'{clients} clients posting grades for {len(SCHOOLS)} schools for {seconds:g}s')
+    print(f'{"layout":<10}{"writes/s":>10}{"analytics ms":>14}  grades per shard by school')
+    for sharded in (False, True):
+        with tempfile.TemporaryDirectory() as directory:
+            writes, errors, status, analytics, placement = run(directory, sharded, seconds, clients)
+        print(f'{"sharded" if sharded else "single":<10}{writes / seconds:>10.0f}'
+              f'{analytics if status == 200 else float("nan"):>14.1f}  {placement}'
+              + (f'  errors {errors}' if errors else ''))
+
+
+if __name__ == '__main__':
+    main()
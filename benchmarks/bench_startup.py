@@ -0,0 +1,57 @@
+'''
+Measures cold start (import, create_app and the first
+request) in fresh processes and fails if the median is over budget.
+
+    python -m benchmarks.bench_startup [runs]
+
+STARTUP_BUDGET_MS overrides the default budget.
+'''
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_BUDGET_MS = 1500
+
+COLD_START = '''
+import time
+start = time.perf_counter()
+from project import create_app
+imported = time.perf_counter()
+application = create_app()
+created = time.perf_counter()
+application.test_client().get('/')
+served = time.perf_counter()
+print(imported - start, created - imported, served - created)
+'''
+
+
+def cold_start(env):
+    output = subprocess.run(
+        [sys.executable, '-c', COLD_START], env=env, check=True,
+        capture_output=True, text=True).stdout
+    return [float(value) * 1000 for value in output.split()]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    budget = float(os.environ.get('STARTUP_BUDGET_MS', DEFAULT_BUDGET_MS))
+    env = dict(os.environ)
+    env.setdefault('AWS_DATABASE_URL', 'sqlite://')
+
+    samples = [cold_start(env) for _ in range(runs)]
+    imports, creates, first_requests = zip(*samples)
+    totals = [sum(sample) for sample in samples]
+
+    print(f'{"import ms":>12}{"create_app ms":>15}{"first request ms":>18}{"total ms":>12}')
+    print(f'{statistics.median(imports):>12.1f}{statistics.median(creates):>15.1f}'
+          f'{statistics.median(first_requests):>18.1f}{statistics.median(totals):>12.1f}')
+
+    median = statistics.median(totals)
+    if median > budget:
+        sys.exit(f'Cold start {median:.1f}ms is over the {budget:.0f}ms budget')
+    print(f'Cold start {median:.1f}ms is within the {budget:.0f}ms budget')
+
+
+if __name__ == '__main__':
+    main()
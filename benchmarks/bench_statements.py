@@ -0,0 +1,76 @@
+'''
+Per-request CPU spent building and executing the hot queries, ad hoc
+(as views.py used to) against the pre-built statements, plus the
+compiled cache hit rate for each.
+
+    python -m benchmarks.bench_statements [iterations]
+'''
+import sys
+import time
+
+from sqlalchemy import select
+
+from project import create_app, db
+from project.adapted.sharding import DEFAULT_SCHOOL_ID
+from project.adapted.statements import (
+    ENROLLED_STUDENTS, CLASS_LESSON_PLANS, entities_by_key, statement_cache_stats)
+from project.init_db import init_db
+from project.models import Student, Enrollment, Class, LessonPlan
+
+
+# The same queries, built per call the way the handlers used to
+def ad_hoc(class_id, student_id):
+    db.session.execute(select(Class).where(Class.id.in_([class_id]), Class.school_id == DEFAULT_SCHOOL_ID).order_by(Class.id)).scalars().first()
+    db.session.execute(
+        select(Student.id, Student.first_name, Student.last_name)
+        .join(Enrollment, Enrollment.student_id == Student.id)
+        .where(Enrollment.class_id == class_id)
+        .order_by(Enrollment.id)).all()
+    db.session.execute(
+        select(LessonPlan.id, LessonPlan.name, LessonPlan.date, LessonPlan.overview,
+               LessonPlan.objective, LessonPlan.subject)
+        .where(LessonPlan.class_id == class_id)
+        .order_by(LessonPlan.id)).all()
+    db.session.execute(
+        select(Student).where(Student.id.in_([student_id]), Student.school_id == DEFAULT_SCHOOL_ID)
+        .order_by(Student.id)).scalars().first()
+
+
+def prebuilt(class_id, student_id):
+    db.session.execute(entities_by_key(Class), {'keys': [class_id], 'school_id': DEFAULT_SCHOOL_ID}).scalars().first()
+    db.session.execute(ENROLLED_STUDENTS, {'class_id': class_id}).all()
+    db.session.execute(CLASS_LESSON_PLANS, {'class_id': class_id}).all()
+    db.session.execute(
+        entities_by_key(Student), {'keys': [student_id], 'school_id': DEFAULT_SCHOOL_ID}).scalars().first()
+
+
+def run(fn, iterations):
+    statement_cache_stats.reset()
+    start = time.process_time()
+    for i in range(iterations):
+        fn(1 + i % 2, 1 + i % 10)
+        # Each request gets a fresh session
+        db.session.remove()
+    elapsed = time.process_time() - start
+    return elapsed, statement_cache_stats.to_json()
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    application = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'})
+    init_db(db, application)
+    with application.app_context():
+        run(prebuilt, 100)
+        print(f'{iterations} requests')
+        print(f'{"path":<12}{"cpu ms":>10}{"us/request":>12}{"hit rate":>10}')
+        results = {}
+        for name, fn in (('ad hoc', ad_hoc), ('prebuilt', prebuilt)):
+            elapsed, stats = run(fn, iterations)
+            results[name] = elapsed
+            print(f'{name:<12}{elapsed * 1000:>10.1f}{elapsed * 1e6 / iterations:>12.1f}{stats["hit_rate"]:>10.3f}')
+        saved = (results['ad hoc'] - results['prebuilt']) * 1e6 / iterations
+        print(f'saved {saved:.1f}us of CPU per request')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+import os
+
+# Elastic Beanstalk's nginx proxies to port 8000
+bind = ':8000'
+workers = int(os.environ.get('WEB_CONCURRENCY', 3))
+# Event streams go to the gevent process (gunicorn_events.conf.py). One
+# that reaches these sync workers holds a thread until it closes, so the
+# app caps them at a quarter of the threads (see EVENTS_MAX_SUBSCRIBERS in
+# project/adapted/events.py)
+threads = int(os.environ.get('WORKER_THREADS', 16))
+# The app checks its events backend against the worker count
+raw_env = [f'WEB_CONCURRENCY={workers}']
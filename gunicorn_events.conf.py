@@ -0,0 +1,18 @@
+import os
+
+# Serves /class/<id>/events only, nginx routes the streams here (see
+# .platform/nginx/conf.d/elasticbeanstalk/events.conf). On gevent workers
+# an open stream is a greenlet rather than an OS thread, so one process
+# holds thousands of them, all fed by one LISTEN connection per shard.
+bind = '127.0.0.1:8001'
+worker_class = 'gevent'
+workers = int(os.environ.get('EVENTS_WORKERS', 1))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+# Writes are handled by the web processes, streams only hear of them through NOTIFY
+raw_env = ['EVENTS_BACKEND=postgres', f'WORKER_CONNECTIONS={worker_connections}']
+
+
+def post_fork(server, worker):
+    # psycopg2 waits inside C, this makes it yield to the other greenlets
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
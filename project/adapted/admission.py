@@ -0,0 +1,327 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, request
+from sqlalchemy.pool import QueuePool
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+logger = logging.getLogger(__name__)
+
+MAX_MEMORY_BUCKETS = 10000
+
+# Endpoints that only do a couple of indexed lookups (or none). They are
+# never shed or capped, so they stay fast while heavier routes back off.
+DEFAULT_CHEAP_ENDPOINTS = {
+    'index_page.hello_world',
+    'index_page.statement_cache_metrics',
+    'index_page.admission_metrics',
+    'index_page.class_students',
+    'index_page.class_lesson_plans',
+    'index_page.class_lesson_plan_accommodations',
+    'index_page.class_changes',
+}
+
+# Concurrent requests per worker process
+DEFAULT_CONCURRENCY = {
+    'index_page.export_grades': 2,
+    'index_page.school_grade_analytics': 2,
+    'index_page.class_grade_analytics': 8,
+    'index_page.update_bulk': 2,
+    # Each one renders on a pool of processes
+    'index_page.class_report_cards': 1,
+    'index_page.school_report_cards': 1,
+}
+
+# (tokens per second, burst) replacing the default bucket for a route
+DEFAULT_ROUTE_LIMITS = {
+    'index_page.export_grades': (1 / 60, 5),
+    'index_page.school_grade_analytics': (1 / 10, 10),
+    'index_page.school_report_cards': (1 / 300, 2),
+}
+
+### POOL WAIT ###
+
+
+class PoolWaitStats:
+    '''
+    Moving average of how long checkouts waited on the connection pool,
+    or the age of the oldest checkout still waiting if that is longer.
+    Samples older than the window are ignored, so shedding stops once
+    nothing has been waiting.
+    '''
+
+    def __init__(self, alpha=0.2):
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.average = 0.0
+            self.updated = None
+            self.checkouts = 0
+            self._waiting = {}
+
+    def start(self):
+        token = object()
+        with self._lock:
+            self._waiting[token] = time.monotonic()
+        return token
+
+    def finish(self, token):
+        now = time.monotonic()
+        with self._lock:
+            seconds = now - self._waiting.pop(token, now)
+            if self.updated is None:
+                self.average = seconds
+            else:
+                self.average = self.alpha * seconds + (1 - self.alpha) * self.average
+            self.updated = now
+            self.checkouts += 1
+
+    def current(self, window):
+        now = time.monotonic()
+        with self._lock:
+            # Dicts keep insertion order, the first one has waited longest
+            oldest = now - next(iter(self._waiting.values()), now)
+            if self.updated is None or now - self.updated > window:
+                return oldest
+            return max(self.average, oldest)
+
+
+pool_wait = PoolWaitStats()
+
+
+class TimedQueuePool(QueuePool):
+    '''QueuePool that records how long each checkout took, waiting included'''
+
+    def connect(self):
+        token = pool_wait.start()
+        try:
+            return super().connect()
+        finally:
+            pool_wait.finish(token)
+
+### RATE LIMIT STORES ###
+
+
+class MemoryBucketStore:
+    '''Token buckets for this process only, least recently seen clients are dropped first'''
+
+    def __init__(self, max_buckets=MAX_MEMORY_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            # An evicted bucket is as good as a full one
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, tokens
+
+
+TOKEN_BUCKET_SCRIPT = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+'''
+
+
+class RedisBucketStore:
+    '''
+    Token buckets shared by every instance behind the load balancer. The
+    refill and take run as one script on the Redis server (using its
+    clock), so concurrent requests can't both spend the last token.
+    '''
+
+    def __init__(self, url, prefix='ratelimit:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RATELIMIT_STORAGE_URL points at Redis but redis is not installed')
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def take(self, key, rate, burst):
+        try:
+            allowed, tokens = self._script(keys=[self.prefix + key], args=[rate, burst])
+        except Exception:
+            # Losing the limiter shouldn't take the site down with it
+            logger.warning('Rate limit store unavailable, letting the request through', exc_info=True)
+            return True, burst
+        return bool(allowed), float(tokens)
+
+
+def make_bucket_store(url):
+    if url.startswith('memory://'):
+        return MemoryBucketStore()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBucketStore(url)
+    raise ValueError(f'Unsupported RATELIMIT_STORAGE_URL: {url}')
+
+### ADMISSION ###
+
+
+class AdmissionController:
+    '''
+    Runs before every request, cheapest check first:
+
+    1. load shedding, 503 for anything but cheap endpoints while the
+       pool wait is over ADMISSION_SHED_WAIT
+    2. per client token bucket, 429 once a client spends its burst. Off
+       until RATELIMIT_TRUSTED_PROXIES is set, see init_admission
+    3. per route concurrency cap, 503 when the route is already full
+
+    Concurrency slots are held until the request is torn down, which for
+    stream_with_context responses is after the last chunk is sent.
+    '''
+
+    def __init__(self, app):
+        self.enabled = app.config['ADMISSION_ENABLED']
+        self.cheap_endpoints = set(app.config['ADMISSION_CHEAP_ENDPOINTS'])
+        self.shed_wait = app.config['ADMISSION_SHED_WAIT']
+        self.shed_window = app.config['ADMISSION_SHED_WINDOW']
+        self.retry_after = app.config['ADMISSION_RETRY_AFTER']
+        self.rate = app.config['RATELIMIT_RATE']
+        self.burst = app.config['RATELIMIT_BURST']
+        self.route_limits = dict(app.config['RATELIMIT_ROUTE_LIMITS'])
+        self.rate_limiting = app.config['RATELIMIT_TRUSTED_PROXIES'] is not None
+        self.store = make_bucket_store(app.config['RATELIMIT_STORAGE_URL'])
+        self.capacity = dict(app.config['ADMISSION_CONCURRENCY'])
+        self._slots = {endpoint: threading.BoundedSemaphore(limit) for endpoint, limit in self.capacity.items()}
+        self._lock = threading.Lock()
+        self.in_flight = {endpoint: 0 for endpoint in self.capacity}
+        self.rate_limited = 0
+        self.shed = 0
+        self.over_capacity = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _reject(self, counter, status, error, retry_after):
+        self._count(counter)
+        return {'error': error}, status, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+    def client_key(self):
+        return request.remote_addr or 'unknown'
+
+    def before_request(self):
+        if not self.enabled or request.method == 'OPTIONS':
+            return None
+        endpoint = request.endpoint
+        cheap = endpoint in self.cheap_endpoints
+
+        if not cheap and pool_wait.current(self.shed_window) > self.shed_wait:
+            return self._reject('shed', 503, 'Server is overloaded, please retry shortly', self.retry_after)
+
+        if self.rate_limiting:
+            rate, burst = self.route_limits.get(endpoint, (self.rate, self.burst))
+            key = self.client_key()
+            if endpoint in self.route_limits:
+                key = f'{key}:{endpoint}'
+            allowed, tokens = self.store.take(key, rate, burst)
+            if not allowed:
+                return self._reject('rate_limited', 429, 'Too many requests', (1 - tokens) / rate)
+
+        slots = None if cheap else self._slots.get(endpoint)
+        if slots is not None:
+            if not slots.acquire(blocking=False):
+                return self._reject('over_capacity', 503, 'Too many concurrent requests for this resource',
+                                    self.retry_after)
+            with self._lock:
+                self.in_flight[endpoint] += 1
+            g.admission_slot = endpoint
+        return None
+
+    def teardown_request(self, exc=None):
+        endpoint = g.pop('admission_slot', None)
+        if endpoint is not None:
+            with self._lock:
+                self.in_flight[endpoint] -= 1
+            self._slots[endpoint].release()
+
+    def to_json(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "rate_limiting": self.rate_limiting,
+                "pool_wait": pool_wait.current(self.shed_window),
+                "shedding": pool_wait.current(self.shed_window) > self.shed_wait,
+                "rate_limited": self.rate_limited,
+                "shed": self.shed,
+                "over_capacity": self.over_capacity,
+                "in_flight": dict(self.in_flight),
+                "capacity": dict(self.capacity)
+            }
+
+
+'''
+Has to run before db.init_app so the engine is built with the timed pool.
+Rate limits are keyed on the client address, so RATELIMIT_TRUSTED_PROXIES
+(or the environment variable of the same name) has to be the number of
+proxies in front of the app for that to be read from X-Forwarded-For: 1
+for Elastic Beanstalk's nginx on a single instance environment, 2 with a
+load balancer in front of it too, 0 when clients connect directly.
+Until it is set every client looks like the proxy, so per client rate
+limits stay off rather than throttle everyone as one client.
+'''
+
+
+def init_admission(app):
+    app.config.setdefault('ADMISSION_ENABLED', True)
+    app.config.setdefault('ADMISSION_CHEAP_ENDPOINTS', DEFAULT_CHEAP_ENDPOINTS)
+    app.config.setdefault('ADMISSION_CONCURRENCY', DEFAULT_CONCURRENCY)
+    app.config.setdefault('ADMISSION_SHED_WAIT', 0.25)
+    app.config.setdefault('ADMISSION_SHED_WINDOW', 5)
+    app.config.setdefault('ADMISSION_RETRY_AFTER', 5)
+    app.config.setdefault('RATELIMIT_STORAGE_URL', 'memory://')
+    app.config.setdefault('RATELIMIT_RATE', 20)
+    app.config.setdefault('RATELIMIT_BURST', 100)
+    app.config.setdefault('RATELIMIT_ROUTE_LIMITS', DEFAULT_ROUTE_LIMITS)
+    trusted_proxies = os.environ.get('RATELIMIT_TRUSTED_PROXIES')
+    app.config.setdefault('RATELIMIT_TRUSTED_PROXIES', int(trusted_proxies) if trusted_proxies else None)
+
+    engine_options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    engine_options.setdefault('poolclass', TimedQueuePool)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
+    if app.config['RATELIMIT_TRUSTED_PROXIES'] is None:
+        logger.warning('RATELIMIT_TRUSTED_PROXIES is not set, per client rate limits are off')
+    elif app.config['RATELIMIT_TRUSTED_PROXIES']:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['RATELIMIT_TRUSTED_PROXIES'])
+
+    controller = AdmissionController(app)
+    app.extensions['admission'] = controller
+    app.before_request(controller.before_request)
+    app.teardown_request(controller.teardown_request)
+
+
+def get_admission() -> AdmissionController:
+    return current_app.extensions['admission']
@@ -0,0 +1,290 @@
+from datetime import date
+from typing import NamedTuple
+
+import numpy as np
+from sqlalchemy import select
+
+from project import db
+from project.adapted.analytics_cache import analytics_cache
+from project.adapted.sharding import current_school_id, current_shard, scatter_gather
+from project.models import Enrollment, Grade, SubjectType
+
+SUBJECTS = list(SubjectType)
+SUBJECT_CODES = {subject: code for code, subject in enumerate(SUBJECTS)}
+# Grades without a subject get their own bucket, named "None" like the gradebook shows them
+NO_SUBJECT = -1
+
+DEFAULT_ROLLING_WINDOW = 3
+# Rows fetched per round trip while loading columns
+LOAD_BATCH_SIZE = 10000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+HISTOGRAM_BINS = np.linspace(0, 100, 11)
+
+
+class GradeColumns(NamedTuple):
+    grade_id: np.ndarray
+    student_id: np.ndarray
+    subject: np.ndarray
+    date: np.ndarray
+    grade_value: np.ndarray
+
+    def __len__(self):
+        return len(self.grade_id)
+
+
+def class_grade_query(class_id, school_year):
+    return (
+        select(Grade.id, Grade.student_id, Grade.subject, Grade.date, Grade.grade_value)
+        .join(Enrollment, Enrollment.student_id == Grade.student_id)
+        .where(Enrollment.class_id == class_id)
+        .where(*Grade.in_school_year(school_year))
+        .where(Grade.grade_value.is_not(None))
+    )
+
+
+def school_grade_query(school_year, school_id=None):
+    statement = (
+        select(Grade.id, Grade.student_id, Grade.subject, Grade.date, Grade.grade_value)
+        .where(*Grade.in_school_year(school_year))
+        .where(Grade.grade_value.is_not(None))
+    )
+    # Every school on the shard when there is none
+    if school_id is not None:
+        statement = statement.where(Grade.in_school(school_id))
+    return statement
+
+
+def empty_columns(size=0) -> GradeColumns:
+    return GradeColumns(
+        np.empty(size, np.int64), np.empty(size, np.int64), np.empty(size, np.int8),
+        np.empty(size, 'datetime64[D]'), np.empty(size, np.float64))
+
+
+def _grow(columns: GradeColumns, size) -> GradeColumns:
+    grown = empty_columns(size)
+    for old, new in zip(columns, grown):
+        new[:len(old)] = old
+    return grown
+
+
+'''
+Runs a single projection query and loads each column straight into a
+NumPy array without building ORM objects. Rows come off the cursor
+LOAD_BATCH_SIZE at a time and are copied into preallocated arrays, so
+only one batch of row tuples exists at once.
+'''
+
+
+def load_grade_columns(statement) -> GradeColumns:
+    result = db.session.execute(statement.execution_options(yield_per=LOAD_BATCH_SIZE))
+    columns = empty_columns(LOAD_BATCH_SIZE)
+    n = 0
+    for rows in result.partitions():
+        end = n + len(rows)
+        if end > len(columns):
+            columns = _grow(columns, max(end, 2 * len(columns)))
+        count = len(rows)
+        grade_ids, student_ids, subjects, dates, values = zip(*rows)
+        columns.grade_id[n:end] = np.fromiter(grade_ids, np.int64, count)
+        columns.student_id[n:end] = np.fromiter(student_ids, np.int64, count)
+        columns.subject[n:end] = np.fromiter((SUBJECT_CODES.get(subject, NO_SUBJECT) for subject in subjects), np.int8, count)
+        # Days since 1970-01-01, converting date objects one by one is far slower
+        columns.date.view(np.int64)[n:end] = np.fromiter(map(date.toordinal, dates), np.int64, count) - EPOCH_ORDINAL
+        columns.grade_value[n:end] = np.fromiter(values, np.float64, count)
+        n = end
+    return GradeColumns(*(column[:n] for column in columns))
+
+
+'''
+Loads the columns from every shard. Student ids are only unique within a
+shard, so each shard's ids are moved into their own range before the
+columns are put together.
+'''
+
+
+def load_sharded_grade_columns(statement) -> GradeColumns:
+    parts = [columns for _, columns in scatter_gather(load_grade_columns, statement)]
+    if len(parts) == 1:
+        return parts[0]
+    return GradeColumns(
+        np.concatenate([columns.grade_id for columns in parts]),
+        np.concatenate([columns.student_id + (index << 32) for index, columns in enumerate(parts)]),
+        np.concatenate([columns.subject for columns in parts]),
+        np.concatenate([columns.date for columns in parts]),
+        np.concatenate([columns.grade_value for columns in parts]),
+    )
+
+### VECTORIZED STATISTICS ###
+
+
+def percentile_ranks(values, population=None):
+    # Share of the population below each value, counting ties as half
+    population = np.sort(values if population is None else population)
+    if len(population) == 0:
+        return np.full(len(values), np.nan)
+    below = np.searchsorted(population, values, side='left')
+    at_or_below = np.searchsorted(population, values, side='right')
+    return (below + (at_or_below - below) / 2) / len(population) * 100
+
+
+def z_scores(values):
+    if len(values) == 0:
+        return np.empty(0)
+    std = values.std()
+    if std == 0:
+        return np.zeros(len(values))
+    return (values - values.mean()) / std
+
+
+def student_means(columns: GradeColumns):
+    student_ids, inverse = np.unique(columns.student_id, return_inverse=True)
+    counts = np.bincount(inverse)
+    means = np.bincount(inverse, weights=columns.grade_value) / counts
+    return student_ids, counts, means
+
+
+'''
+Rolling average of each student's last `window` grades per subject, in
+date order. Uses a cumulative sum so the whole column is done at once.
+'''
+
+
+def rolling_averages(columns: GradeColumns, window=DEFAULT_ROLLING_WINDOW):
+    order = np.lexsort((columns.grade_id, columns.date, columns.subject, columns.student_id))
+    student_id = columns.student_id[order]
+    subject = columns.subject[order]
+    values = columns.grade_value[order]
+    n = len(values)
+    if n == 0:
+        return order, np.empty(0)
+
+    new_group = np.empty(n, dtype=bool)
+    new_group[0] = True
+    new_group[1:] = (student_id[1:] != student_id[:-1]) | (subject[1:] != subject[:-1])
+    group_starts = np.flatnonzero(new_group)
+    position = np.arange(n) - group_starts[np.cumsum(new_group) - 1]
+
+    cumulative = np.concatenate(([0.0], np.cumsum(values)))
+    end = np.arange(1, n + 1)
+    start = end - np.minimum(position + 1, window)
+    return order, (cumulative[end] - cumulative[start]) / (end - start)
+
+
+def subject_name(code):
+    return str(None) if code == NO_SUBJECT else str(SUBJECTS[code])
+
+
+def subject_distributions(columns: GradeColumns):
+    distributions = {}
+    for code in [*SUBJECT_CODES.values(), NO_SUBJECT]:
+        values = columns.grade_value[columns.subject == code]
+        if len(values) == 0:
+            continue
+        p25, median, p75 = np.percentile(values, [25, 50, 75])
+        histogram, _ = np.histogram(np.clip(values, 0, 100), bins=HISTOGRAM_BINS)
+        distributions[subject_name(code)] = {
+            "count": int(len(values)),
+            "mean": float(values.mean()),
+            "std": float(values.std()),
+            "min": float(values.min()),
+            "p25": float(p25),
+            "median": float(median),
+            "p75": float(p75),
+            "max": float(values.max()),
+            "histogram": {
+                "bins": HISTOGRAM_BINS.tolist(),
+                "counts": histogram.tolist()
+            }
+        }
+    return distributions
+
+### ANALYTICS ###
+
+
+'''
+Statistics for one school, read from the request's shard, or for the
+whole district (school_id None) gathered from every shard
+'''
+
+
+def school_analytics(school_year, school_id=None):
+    key = (None, school_year, school_id)
+    entry = analytics_cache.get(key)
+    if entry is None:
+        generation = analytics_cache.generation
+        if school_id is None:
+            columns = load_sharded_grade_columns(school_grade_query(school_year))
+        else:
+            columns = load_grade_columns(school_grade_query(school_year, school_id))
+        student_ids, _, means = student_means(columns)
+        entry = {
+            "student_ids": frozenset(student_ids.tolist()),
+            "sorted_means": np.sort(means),
+            "payload": {
+                "school_id": school_id,
+                "school_year": school_year,
+                "grade_count": len(columns),
+                "student_count": int(len(student_ids)),
+                "mean": float(columns.grade_value.mean()) if len(columns) else None,
+                "subjects": subject_distributions(columns)
+            }
+        }
+        analytics_cache.set(key, entry, generation)
+    return entry
+
+
+def class_analytics(class_id, school_year, window=DEFAULT_ROLLING_WINDOW):
+    # Class ids repeat across shards
+    key = (class_id, school_year, current_shard())
+    entry = analytics_cache.get(key)
+    if entry is not None and entry['window'] == window:
+        return entry['payload']
+
+    generation = analytics_cache.generation
+    columns = load_grade_columns(class_grade_query(class_id, school_year))
+    student_ids, counts, means = student_means(columns)
+    class_percentiles = percentile_ranks(means)
+    school_percentiles = percentile_ranks(means, school_analytics(school_year, current_school_id())['sorted_means'])
+    z = z_scores(means)
+
+    order, rolling = rolling_averages(columns, window)
+    rolling_student_ids = columns.student_id[order]
+    rolling_subjects = columns.subject[order]
+    rolling_grade_ids = columns.grade_id[order].tolist()
+    rolling_dates = columns.date[order].tolist()
+    rolling_by_student = {}
+    for i, (student_id, subject_code) in enumerate(zip(rolling_student_ids.tolist(), rolling_subjects.tolist())):
+        subjects = rolling_by_student.setdefault(student_id, {})
+        subjects.setdefault(subject_name(subject_code), []).append({
+            "grade_id": rolling_grade_ids[i],
+            "date": rolling_dates[i],
+            "rolling_average": float(rolling[i])
+        })
+
+    students = []
+    for i, student_id in enumerate(student_ids.tolist()):
+        students.append({
+            "id": student_id,
+            "grade_count": int(counts[i]),
+            "mean": float(means[i]),
+            "z_score": float(z[i]),
+            "percentile_rank": float(class_percentiles[i]),
+            "school_percentile_rank": float(school_percentiles[i]),
+            "rolling_averages": rolling_by_student.get(student_id, {})
+        })
+
+    payload = {
+        "id": class_id,
+        "school_year": school_year,
+        "rolling_window": window,
+        "grade_count": len(columns),
+        "mean": float(columns.grade_value.mean()) if len(columns) else None,
+        "students": students,
+        "subjects": subject_distributions(columns)
+    }
+    analytics_cache.set(key, {
+        "student_ids": frozenset(student_ids.tolist()),
+        "window": window,
+        "payload": payload
+    }, generation)
+    return payload
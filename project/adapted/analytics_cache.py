@@ -0,0 +1,126 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from project.models import Enrollment, Class, Grade
+
+MAX_CACHE_ENTRIES = 256
+# Seconds, writes made by other processes show up once entries expire
+DEFAULT_CACHE_TTL = 30
+
+
+'''
+Kept apart from the analytics module so write handlers can invalidate
+cached results without importing NumPy
+'''
+
+
+class AnalyticsCache:
+    def __init__(self, max_entries=MAX_CACHE_ENTRIES, ttl=DEFAULT_CACHE_TTL):
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # Bumped by every invalidation, see set()
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry, generation):
+        # generation is read before the data is loaded. If a write committed
+        # in between, the data may predate it, so it isn't kept.
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, student_ids=(), class_ids=()):
+        student_ids = set(student_ids)
+        class_ids = set(class_ids)
+        with self._lock:
+            self.generation += 1
+            for key in list(self._entries):
+                class_id = key[0]
+                _, entry = self._entries[key]
+                # School wide entries depend on every grade
+                if class_id is None and student_ids:
+                    del self._entries[key]
+                elif class_id in class_ids or not student_ids.isdisjoint(entry['student_ids']):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+analytics_cache = AnalyticsCache()
+
+
+def init_analytics_cache(app):
+    # The cache is per process, the TTL bounds how stale the others get
+    app.config.setdefault('ANALYTICS_CACHE_TTL', DEFAULT_CACHE_TTL)
+    analytics_cache.ttl = app.config['ANALYTICS_CACHE_TTL']
+
+
+def invalidate_grade_analytics(student_ids=(), class_ids=()):
+    analytics_cache.invalidate(student_ids, class_ids)
+
+
+def _old_and_new_values(instance, key):
+    # Attribute history is still available in after_flush
+    history = inspect(instance).attrs[key].history
+    return set(history.unchanged) | set(history.added) | set(history.deleted)
+
+
+'''
+Ids are collected while flushing but only invalidated once the
+transaction commits, until then other requests still read the old rows
+and would cache them again.
+'''
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_invalidations(session, flush_context):
+    student_ids = set()
+    class_ids = set()
+    for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(instance, Grade):
+            student_ids.update(_old_and_new_values(instance, 'student_id'))
+        elif isinstance(instance, Enrollment):
+            class_ids.update(_old_and_new_values(instance, 'class_id'))
+        elif isinstance(instance, Class):
+            class_ids.add(instance.id)
+    if student_ids or class_ids:
+        pending_student_ids, pending_class_ids = session.info.setdefault(
+            'analytics_invalidations', (set(), set()))
+        pending_student_ids.update(student_ids)
+        pending_class_ids.update(class_ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    pending = session.info.pop('analytics_invalidations', None)
+    if pending:
+        invalidate_grade_analytics(*pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_invalidations(session):
+    session.info.pop('analytics_invalidations', None)
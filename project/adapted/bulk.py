@@ -0,0 +1,277 @@
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import Date, select, update
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+from project import db
+from project.adapted.analytics_cache import invalidate_grade_analytics
+from project.adapted.changes import class_columns, record_bulk_update
+from project.adapted.loaders import load, load_many
+from project.adapted.sharding import current_school_id
+from project.models import (
+    Teacher, Student, Enrollment, Class, LessonPlan, Grade, GradeType, SubjectType,
+    school_year_bounds, validate_school_year)
+
+
+class BulkUpdateError(ValueError):
+    pass
+
+
+class date_add_days(FunctionElement):
+    type = Date()
+    name = 'date_add_days'
+    inherit_cache = True
+
+
+@compiles(date_add_days)
+def _compile_date_add_days(element, compiler, **kw):
+    # Postgres: date + integer is a date
+    column, days = element.clauses
+    return f'({compiler.process(column, **kw)} + {compiler.process(days, **kw)})'
+
+
+@compiles(date_add_days, 'sqlite')
+def _compile_date_add_days_sqlite(element, compiler, **kw):
+    column, days = element.clauses
+    return f"date({compiler.process(column, **kw)}, printf('%+d days', {compiler.process(days, **kw)}))"
+
+### VALUES ###
+
+
+def _integer(value):
+    if isinstance(value, bool) or isinstance(value, float) or value is None:
+        raise ValueError('Expected an integer')
+    return int(value)
+
+
+def _number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('Expected a number')
+    return value
+
+
+def _date(value):
+    if not isinstance(value, str):
+        raise ValueError('Expected a date YYYY-mm-dd')
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def _text(value):
+    if not isinstance(value, str):
+        raise ValueError('Expected a string')
+    return value
+
+
+def _enum(enum):
+    def parse(value):
+        return enum(value)
+    return parse
+
+
+def _school_year(value):
+    return validate_school_year(_text(value))
+
+
+ORDERED = (_integer, _number, _date)
+
+# Patched foreign keys are checked before the update runs
+REFERENCES = {'student_id': Student, 'class_id': Class, 'teacher_id': Teacher}
+
+### ENTITIES ###
+
+
+class BulkEntity(NamedTuple):
+    model: type
+    # Column name -> parser, for filters and patches alike
+    columns: dict
+    filters: tuple
+    # Column name -> patch operations allowed on it
+    patches: dict
+    # Every update names its rows by at least one of these
+    anchors: tuple
+
+
+BULK_ENTITIES = {
+    'grade': BulkEntity(
+        Grade,
+        columns={'id': _integer, 'student_id': _integer, 'grade_type': _enum(GradeType),
+                 'subject': _enum(SubjectType), 'date': _date, 'grade_value': _number},
+        filters=('id', 'student_id', 'class_id', 'grade_type', 'subject', 'date', 'grade_value'),
+        patches={'grade_value': ('set', 'add', 'multiply'), 'grade_type': ('set',),
+                 'subject': ('set',), 'date': ('set', 'add_days')},
+        anchors=('id', 'student_id', 'class_id')),
+    'lesson_plan': BulkEntity(
+        LessonPlan,
+        columns={'id': _integer, 'class_id': _integer, 'name': _text, 'date': _date,
+                 'overview': _text, 'objective': _text, 'subject': _enum(SubjectType)},
+        filters=('id', 'class_id', 'date', 'subject'),
+        patches={'class_id': ('set',), 'name': ('set',), 'date': ('set', 'add_days'),
+                 'overview': ('set',), 'objective': ('set',), 'subject': ('set',)},
+        anchors=('id', 'class_id')),
+    'enrollment': BulkEntity(
+        Enrollment,
+        columns={'id': _integer, 'student_id': _integer, 'class_id': _integer},
+        filters=('id', 'student_id', 'class_id'),
+        patches={'class_id': ('set',)},
+        anchors=('id', 'student_id', 'class_id')),
+    'class': BulkEntity(
+        Class,
+        columns={'id': _integer, 'teacher_id': _integer, 'name': _text, 'school_year': _school_year},
+        filters=('id', 'teacher_id', 'school_year'),
+        patches={'teacher_id': ('set',), 'name': ('set',), 'school_year': ('set',)},
+        anchors=('id', 'teacher_id')),
+}
+
+
+def _parse(entity, name, value):
+    try:
+        return entity.columns[name](value)
+    except (TypeError, ValueError) as e:
+        raise BulkUpdateError(f'Invalid value for {name}: {e}')
+
+
+'''
+Each filter is a value (equals), a list (in) or a dict of gt/gte/lt/lte
+bounds for ids, numbers and dates. Filters are ANDed together, and at
+least one of them must be an anchor (an id, or the student, class or
+teacher the rows belong to) given as a value or list, so a filter like
+{"grade_value": {"gte": 0}} can't turn into a table wide update.
+
+Every update is also limited to the rows of the request's school, and
+student, class and teacher ids are looked up first so an id from another
+school is rejected rather than matching nothing.
+'''
+
+
+def _column_filter(entity, name, value):
+    column = getattr(entity.model, name)
+    if isinstance(value, list):
+        if not value:
+            raise BulkUpdateError(f'Empty list for {name}')
+        return [column.in_([_parse(entity, name, item) for item in value])]
+    if isinstance(value, dict):
+        if entity.columns[name] not in ORDERED:
+            raise BulkUpdateError(f'{name} does not support ranges')
+        bounds = {'gt': column.__gt__, 'gte': column.__ge__, 'lt': column.__lt__, 'lte': column.__le__}
+        if not value or not set(value) <= set(bounds):
+            raise BulkUpdateError(f'Invalid range for {name}. Please use gt, gte, lt or lte')
+        return [bounds[op](_parse(entity, name, bound)) for op, bound in value.items()]
+    return [column == _parse(entity, name, value)]
+
+
+def _check_references(entity, name, value):
+    # Grades in a class are checked by _class_grades_filter
+    if name not in REFERENCES or name not in entity.columns or isinstance(value, dict):
+        return
+    keys = [_parse(entity, name, item) for item in value] if isinstance(value, list) else [_parse(entity, name, value)]
+    if not all(load_many(REFERENCES[name], keys)):
+        raise BulkUpdateError(f'Invalid {name.replace("_id", "")} ID')
+
+
+def _class_grades_filter(value):
+    # Grades belong to students, "in class Y" means the class's students
+    # during the class's school year (same as /class/<id>/grades)
+    class_ = load(Class, _integer(value)) if not isinstance(value, (list, dict)) else None
+    if class_ is None:
+        raise BulkUpdateError('Invalid class ID')
+    start, end = school_year_bounds(class_.school_year)
+    enrolled = select(Enrollment.student_id).where(Enrollment.class_id == class_.id)
+    return [Grade.student_id.in_(enrolled), Grade.date >= start, Grade.date < end]
+
+
+def build_where(entity, filters):
+    if not isinstance(filters, dict) or not filters:
+        raise BulkUpdateError('At least one filter is required')
+    if not any(name in entity.anchors and not isinstance(value, dict) for name, value in filters.items()):
+        raise BulkUpdateError(f'Please filter on a value or list of one of: {", ".join(entity.anchors)}')
+    where = [entity.model.in_school(current_school_id())]
+    for name, value in filters.items():
+        if name not in entity.filters:
+            raise BulkUpdateError(f'Cannot filter on {name}. Please use one of: {", ".join(entity.filters)}')
+        _check_references(entity, name, value)
+        if entity.model is Grade and name == 'class_id':
+            try:
+                where.extend(_class_grades_filter(value))
+            except BulkUpdateError:
+                raise
+            except (TypeError, ValueError) as e:
+                raise BulkUpdateError(f'Invalid value for class_id: {e}')
+        else:
+            where.extend(_column_filter(entity, name, value))
+    return where
+
+
+'''
+Each patch is a value to set or a single {"add": n}, {"multiply": n} or
+{"add_days": n} applied in SQL to the current value.
+'''
+
+
+def build_values(entity, patch):
+    if not isinstance(patch, dict) or not patch:
+        raise BulkUpdateError('At least one field to update is required')
+    values = {}
+    for name, value in patch.items():
+        if name not in entity.patches:
+            raise BulkUpdateError(f'Cannot update {name}. Please use one of: {", ".join(entity.patches)}')
+        column = getattr(entity.model, name)
+        op, operand = next(iter(value.items())) if isinstance(value, dict) and len(value) == 1 else ('set', value)
+        if op not in entity.patches[name]:
+            raise BulkUpdateError(f'Invalid update for {name}. Please use one of: {", ".join(entity.patches[name])}')
+
+        if op == 'set':
+            operand = _parse(entity, name, operand)
+            if name in REFERENCES and not load(REFERENCES[name], operand):
+                raise BulkUpdateError(f'Invalid {name.replace("_id", "")} ID')
+            values[name] = operand
+        elif op == 'add_days':
+            try:
+                values[name] = date_add_days(column, _integer(operand))
+            except (TypeError, ValueError) as e:
+                raise BulkUpdateError(f'Invalid value for {name}: {e}')
+        else:
+            operand = _parse(entity, name, operand)
+            values[name] = column + operand if op == 'add' else column * operand
+    return values
+
+
+'''
+Runs one UPDATE ... WHERE ... RETURNING for every matching row. The
+rows it returns feed the change log and analytics cache invalidation,
+which the ORM flush listeners would otherwise have done per row.
+'''
+
+
+def bulk_update(entity_name, filters, patch):
+    entity = BULK_ENTITIES.get(entity_name)
+    if entity is None:
+        raise BulkUpdateError(f'Invalid entity. Please use one of: {", ".join(BULK_ENTITIES)}')
+    model = entity.model
+    where = build_where(entity, filters)
+    values = build_values(entity, patch)
+
+    # RETURNING only has the new values, so read the old ones when the row may change classes
+    old_values = None
+    changed = [column for column in class_columns(model) if column in values]
+    if changed:
+        old_values = {row.id: row._asdict() for row in db.session.execute(
+            select(model.id, *(getattr(model, column) for column in changed)).where(*where).with_for_update())}
+
+    # A Core UPDATE, nothing in the identity map outlives this request's commit
+    table = model.__table__
+    rows = db.session.execute(
+        update(table).where(*where).values(values).returning(*table.columns)).mappings().all()
+
+    record_bulk_update(db.session, model, rows, old_values)
+    db.session.commit()
+
+    if model is Grade:
+        invalidate_grade_analytics(student_ids={row['student_id'] for row in rows})
+    elif model is Enrollment:
+        old_class_ids = {old['class_id'] for old in (old_values or {}).values()}
+        invalidate_grade_analytics(class_ids={row['class_id'] for row in rows} | old_class_ids)
+    elif model is Class:
+        invalidate_grade_analytics(class_ids={row['id'] for row in rows})
+    return len(rows)
@@ -0,0 +1,284 @@
+from collections import Counter
+from datetime import datetime
+from enum import Enum
+
+from sqlalchemy import Date, DateTime, Float, event, insert, inspect, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from project import db
+from project.adapted.events import publish_changes
+from project.adapted.statements import CHANGES_SINCE
+from project.models import (
+    Enrollment, Class, LessonPlan, Grade, Accommodation, IEP, ChangeLog, ChangeLogCursor, school_year_bounds)
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+
+# Attribute on each tracked model that decides which classes a row belongs to
+TRACKED_MODELS = {
+    Enrollment: 'class_id',
+    LessonPlan: 'class_id',
+    Grade: 'student_id',
+    IEP: 'student_id',
+    Accommodation: 'lesson_plan_id',
+}
+
+# Grades only belong to the classes of their school year, the same ones
+# /class/<id>/grades shows them in
+DATE_COLUMNS = {Grade: 'date'}
+
+
+'''
+Formats a value by its column type, not its Python type. Handlers leave
+what the client sent on the instance (a datetime in a Date column, 57 in
+a Float column) while RETURNING and refreshed rows have the database's
+types, and clients should get "2022-09-01" and 57.0 either way.
+'''
+
+
+def _serialize_value(value, column_type):
+    if value is None:
+        return None
+    if isinstance(value, Enum):
+        return str(value)
+    if isinstance(column_type, Date):
+        return (value.date() if isinstance(value, datetime) else value).isoformat()
+    if isinstance(column_type, DateTime):
+        return value.isoformat()
+    if isinstance(column_type, Float):
+        return float(value)
+    return value
+
+
+def serialize(instance):
+    return {attribute.key: _serialize_value(getattr(instance, attribute.key), attribute.columns[0].type)
+            for attribute in inspect(instance).mapper.column_attrs}
+
+
+def class_columns(model):
+    # Columns whose old values an update needs to tell which classes a row leaves
+    return [column for column in (TRACKED_MODELS.get(model), DATE_COLUMNS.get(model)) if column]
+
+
+def _as_date(value):
+    # Handlers may leave a datetime from the request on the instance
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _old_and_new(instance, key, operation):
+    history = inspect(instance).attrs[key].history
+    old = set(history.unchanged) | set(history.deleted)
+    new = set(history.unchanged) | set(history.added)
+    if operation == 'insert':
+        old = set()
+    elif operation == 'delete':
+        new = set()
+    return old - {None}, new - {None}
+
+
+class _ClassResolver:
+    def __init__(self, connection, keys, lesson_plan_classes=None):
+        self.student_classes = {}
+        self.lesson_plan_classes = dict(lesson_plan_classes or {})
+
+        student_ids = set()
+        lesson_plan_ids = set()
+        for key, old, new in keys:
+            if key == 'student_id':
+                student_ids |= old | new
+            elif key == 'lesson_plan_id':
+                lesson_plan_ids |= old | new
+
+        if student_ids:
+            for student_id, class_id, school_year in connection.execute(
+                    select(Enrollment.student_id, Enrollment.class_id, Class.school_year)
+                    .join(Class, Class.id == Enrollment.class_id)
+                    .where(Enrollment.student_id.in_(student_ids))):
+                start, end = school_year_bounds(school_year)
+                self.student_classes.setdefault(student_id, set()).add((class_id, start, end))
+        lesson_plan_ids -= set(self.lesson_plan_classes)
+        if lesson_plan_ids:
+            self.lesson_plan_classes.update(connection.execute(
+                select(LessonPlan.id, LessonPlan.class_id).where(LessonPlan.id.in_(lesson_plan_ids))).all())
+
+    # dates limits a student's classes to the ones whose school year has one of them
+    def classes(self, key, values, dates=None):
+        if key == 'class_id':
+            return set(values)
+        if key == 'student_id':
+            return {class_id for value in values for class_id, start, end in self.student_classes.get(value, ())
+                    if dates is None or any(start <= _as_date(day) < end for day in dates)}
+        return {self.lesson_plan_classes[value] for value in values if self.lesson_plan_classes.get(value) is not None}
+
+
+'''
+A row moving between classes (e.g. an enrollment's class_id changing) is
+a delete for the old class and an insert for the new one.
+'''
+
+
+def _change_rows(entity, entity_id, operation, data, old_classes, new_classes):
+    rows = []
+    for class_id in old_classes | new_classes:
+        if class_id not in new_classes:
+            class_operation = 'delete'
+        elif class_id not in old_classes:
+            class_operation = 'insert'
+        else:
+            class_operation = operation
+        rows.append({
+            "class_id": class_id,
+            "entity": entity,
+            "entity_id": entity_id,
+            "operation": class_operation,
+            "data": None if class_operation == 'delete' else data
+        })
+    return rows
+
+
+UPSERTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+'''
+Hands out the next `count` seqs of each class. Seqs come from a counter
+row per class rather than a sequence: the upsert keeps the row locked
+until the writer commits. Concurrent writers to a class therefore commit
+in seq order, and a reader past seq N never misses a later-committing N-1.
+Classes are locked in id order so two writers can't deadlock on them.
+'''
+
+
+def _upsert_cursor(connection, class_id, count):
+    statement = UPSERTS[connection.dialect.name](ChangeLogCursor).values(class_id=class_id, seq=count)
+    statement = statement.on_conflict_do_update(
+        index_elements=[ChangeLogCursor.class_id],
+        set_={'seq': ChangeLogCursor.seq + count}
+    ).returning(ChangeLogCursor.seq)
+    return connection.execute(statement).scalar_one()
+
+
+def _bump_cursor(connection, class_id, count):
+    # Any other database: the UPDATE takes the row lock, then the new value is read back
+    cursor = ChangeLogCursor.class_id == class_id
+    if connection.execute(update(ChangeLogCursor).where(cursor).values(seq=ChangeLogCursor.seq + count)).rowcount:
+        return connection.execute(select(ChangeLogCursor.seq).where(cursor)).scalar_one()
+    try:
+        with connection.begin_nested():
+            connection.execute(insert(ChangeLogCursor).values(class_id=class_id, seq=count))
+        return count
+    except IntegrityError:
+        # Another writer created the class's row first
+        return _bump_cursor(connection, class_id, count)
+
+
+def _allocate_seqs(connection, counts):
+    bump = _upsert_cursor if connection.dialect.name in UPSERTS else _bump_cursor
+    return {class_id: bump(connection, class_id, counts[class_id]) - counts[class_id] + 1
+            for class_id in sorted(counts)}
+
+
+def _write_changes(session, connection, rows):
+    if not rows:
+        return
+    next_seqs = _allocate_seqs(connection, Counter(row['class_id'] for row in rows))
+    for row in rows:
+        row['seq'] = next_seqs[row['class_id']]
+        next_seqs[row['class_id']] += 1
+    connection.execute(insert(ChangeLog), rows)
+    publish_changes(session, [{
+        "seq": row['seq'],
+        "class_id": row['class_id'],
+        "entity": row['entity'],
+        "id": row['entity_id'],
+        "operation": row['operation'],
+        "data": row['data']
+    } for row in rows])
+
+
+'''
+Appends a change row per affected class for every tracked insert, update
+and delete, in the same transaction as the write itself.
+'''
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_changes(session, flush_context):
+    changes = []
+    for operation, instances in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for instance in instances:
+            if type(instance) not in TRACKED_MODELS:
+                continue
+            if operation == 'update' and not session.is_modified(instance, include_collections=False):
+                continue
+            key = TRACKED_MODELS[type(instance)]
+            date_column = DATE_COLUMNS.get(type(instance))
+            old_dates, new_dates = _old_and_new(instance, date_column, operation) if date_column else (None, None)
+            changes.append((operation, instance, key, *_old_and_new(instance, key, operation), old_dates, new_dates))
+    if not changes:
+        return
+
+    # Lesson plans deleted in this flush are already gone from the table
+    lesson_plan_classes = {instance.id: instance.class_id for _, instance, *_ in changes
+                           if isinstance(instance, LessonPlan) and instance.class_id is not None}
+    connection = session.connection()
+    resolver = _ClassResolver(connection, [(key, old, new) for _, _, key, old, new, _, _ in changes],
+                              lesson_plan_classes)
+    rows = []
+    for operation, instance, key, old, new, old_dates, new_dates in changes:
+        rows.extend(_change_rows(instance.__tablename__, instance.id, operation, serialize(instance),
+                                 resolver.classes(key, old, old_dates), resolver.classes(key, new, new_dates)))
+    _write_changes(session, connection, rows)
+
+
+'''
+Bulk UPDATE statements skip the flush, so bulk.py hands over the rows it
+got back from RETURNING. old_values maps row ids to what the update
+changed of their class_columns() before it ran.
+'''
+
+
+def record_bulk_update(session, model, rows, old_values=None):
+    key = TRACKED_MODELS.get(model)
+    if key is None or not rows:
+        return
+
+    date_column = DATE_COLUMNS.get(model)
+    old_values = old_values or {}
+    changes = []
+    for row in rows:
+        old_row = {**row, **old_values.get(row['id'], {})}
+        old = {old_row[key]} - {None}
+        new = {row[key]} - {None}
+        old_dates, new_dates = ({old_row[date_column]}, {row[date_column]}) if date_column else (None, None)
+        changes.append((row, old, new, old_dates, new_dates))
+
+    connection = session.connection()
+    resolver = _ClassResolver(connection, [(key, old, new) for _, old, new, _, _ in changes])
+    change_rows = []
+    for row, old, new, old_dates, new_dates in changes:
+        data = {column: _serialize_value(value, model.__table__.c[column].type) for column, value in row.items()}
+        change_rows.extend(_change_rows(model.__tablename__, row['id'], 'update', data,
+                                        resolver.classes(key, old, old_dates), resolver.classes(key, new, new_dates)))
+    _write_changes(session, connection, change_rows)
+
+
+'''
+Changes for a class after the `since` cursor, oldest first. Fetches one
+extra row so callers can tell whether there is more to page through.
+'''
+
+
+def changes_since(class_id, since, limit=DEFAULT_LIMIT):
+    rows = db.session.execute(
+        CHANGES_SINCE, {'class_id': class_id, 'since': since, 'limit': limit + 1}).all()
+
+    changes = [{
+        "seq": seq,
+        "entity": entity,
+        "id": entity_id,
+        "operation": operation,
+        "data": data
+    } for seq, entity, entity_id, operation, data in rows[:limit]]
+    return changes, len(rows) > limit
@@ -0,0 +1,186 @@
+import gzip
+import zlib
+from datetime import date
+from enum import Enum
+from functools import partial
+
+from flask import current_app, jsonify, request, Response
+from werkzeug.http import http_date
+from werkzeug.wsgi import ClosingIterator
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COLUMNAR_MIMETYPE = 'application/vnd.adapted.columnar+json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+DEFAULT_COMPRESS_MIMETYPES = [
+    'application/json',
+    COLUMNAR_MIMETYPE,
+    MSGPACK_MIMETYPE,
+    'text/event-stream',
+    'text/html',
+    'text/csv',
+]
+
+
+def init_compression(app):
+    app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+    app.config.setdefault('COMPRESS_LEVEL', 6)
+    app.config.setdefault('COMPRESS_BROTLI_QUALITY', 4)
+    app.config.setdefault('COMPRESS_MIMETYPES', DEFAULT_COMPRESS_MIMETYPES)
+    app.after_request(compress_response)
+
+
+def choose_encoding(accept_encoding):
+    if brotli is not None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response: Response):
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if 'Content-Encoding' in response.headers:
+        return response
+    if response.mimetype not in current_app.config['COMPRESS_MIMETYPES']:
+        return response
+
+    # Streams are always compressed since we can't know their size up front
+    if not response.is_streamed:
+        if response.content_length is not None and response.content_length < current_app.config['COMPRESS_MIN_SIZE']:
+            return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        response.set_data(_compress_bytes(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _compress_bytes(data: bytes, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=current_app.config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=current_app.config['COMPRESS_LEVEL'])
+
+
+def _compress_stream(chunks, encoding):
+    # Read config now, the generators below only run once the server
+    # iterates the response, after the app context is gone
+    if encoding == 'br':
+        compressed = _brotli_stream(chunks, current_app.config['COMPRESS_BROTLI_QUALITY'])
+    else:
+        compressed = _gzip_stream(chunks, current_app.config['COMPRESS_LEVEL'])
+    # The server only closes the outer iterable, pass it on so the wrapped
+    # stream runs its cleanup (e.g. SSE unsubscribe), started or not
+    return ClosingIterator(compressed, partial(_close, chunks))
+
+
+def _close(chunks):
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+
+
+def _brotli_stream(chunks, quality):
+    compressor = brotli.Compressor(quality=quality)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        # Flush per chunk so clients (e.g. SSE) see data without delay
+        data = compressor.process(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def _gzip_stream(chunks, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+### BODY ENCODINGS ###
+
+
+'''
+Turns every list of dicts sharing the same keys into
+{"columns": [...], "rows": [[...], ...]} so keys are sent once per list
+'''
+
+
+def to_columnar(value):
+    if isinstance(value, dict):
+        return {key: to_columnar(item) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and all(isinstance(item, dict) for item in value):
+            columns = list(value[0].keys())
+            if all(list(item.keys()) == columns for item in value):
+                return {
+                    "columns": columns,
+                    "rows": [[to_columnar(item[column]) for column in columns] for item in value]
+                }
+        return [to_columnar(item) for item in value]
+    return value
+
+
+def _msgpack_default(value):
+    # HTTP dates like jsonify, every Accept type gets the same date format
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, Enum):
+        return str(value)
+    raise TypeError(f'Cannot serialize {type(value)}')
+
+
+def encode_msgpack(payload) -> bytes:
+    return msgpack.packb(payload, default=_msgpack_default)
+
+
+def available_mimetypes():
+    mimetypes = ['application/json', COLUMNAR_MIMETYPE]
+    if msgpack is not None:
+        mimetypes.append(MSGPACK_MIMETYPE)
+    return mimetypes
+
+
+'''
+Drop-in replacement for jsonify on read endpoints. Picks the body
+encoding from the Accept header and falls back to plain JSON.
+'''
+
+
+def encode_response(payload):
+    mimetype = request.accept_mimetypes.best_match(
+        available_mimetypes(), default='application/json')
+
+    if mimetype == MSGPACK_MIMETYPE:
+        response = Response(encode_msgpack(payload), mimetype=MSGPACK_MIMETYPE)
+    elif mimetype == COLUMNAR_MIMETYPE:
+        response = jsonify(to_columnar(payload))
+        response.mimetype = COLUMNAR_MIMETYPE
+    else:
+        response = jsonify(payload)
+
+    response.vary.add('Accept')
+    return response
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+from functools import partial
+
+from flask import current_app
+from sqlalchemy import event, make_url, text
+from sqlalchemy.orm import Session
+from werkzeug.wsgi import ClosingIterator
+
+from project.adapted.sharding import current_shard, shard_engines
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'class_changes'
+MAX_NOTIFY_PAYLOAD = 7500
+RESYNC = object()
+DEFAULT_WORKER_THREADS = 16
+DEFAULT_WORKER_CONNECTIONS = 1000
+
+
+class Subscriber:
+    def __init__(self, key, max_queue):
+        # (shard, class_id), class ids repeat across shards
+        self.key = key
+        self.queue = queue.Queue(maxsize=max_queue)
+
+    def push(self, change):
+        try:
+            self.queue.put_nowait(change)
+        except queue.Full:
+            # Slow consumer, drop its backlog and have it resync from the
+            # change log instead of buffering without limit
+            while True:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            self.queue.put_nowait(RESYNC)
+
+
+'''
+Fans change events out to the SSE subscribers of this process. With the
+postgres backend writes are sent through NOTIFY and one LISTEN connection
+per shard per process feeds the hub, so every instance sees every write.
+'''
+
+
+class EventHub:
+    def __init__(self, app):
+        self.backend = app.config['EVENTS_BACKEND']
+        self.max_queue = app.config['EVENTS_MAX_QUEUE']
+        self.max_subscribers = app.config['EVENTS_MAX_SUBSCRIBERS']
+        self.heartbeat_interval = app.config['EVENTS_HEARTBEAT_INTERVAL']
+        self.max_stream_seconds = app.config['EVENTS_MAX_STREAM_SECONDS']
+        self._app = app
+        self._subscribers = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self._listeners = {}
+
+    def subscribe(self, class_id, shard):
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                return None
+            subscriber = Subscriber((shard, class_id), self.max_queue)
+            self._subscribers.setdefault(subscriber.key, set()).add(subscriber)
+            self._count += 1
+        if self.backend == 'postgres':
+            self._start_listener(shard)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.key, set())
+            if subscriber in subscribers:
+                subscribers.discard(subscriber)
+                self._count -= 1
+            if not subscribers:
+                self._subscribers.pop(subscriber.key, None)
+
+    def publish(self, change, shard):
+        with self._lock:
+            subscribers = list(self._subscribers.get((shard, change['class_id']), ()))
+        for subscriber in subscribers:
+            subscriber.push(change)
+
+    def _start_listener(self, shard):
+        with self._lock:
+            if shard in self._listeners:
+                return
+            listener = self._listeners[shard] = threading.Thread(
+                target=self._listen, args=(shard,), name=f'event-hub-listener-{shard}', daemon=True)
+        listener.start()
+
+    def _listen(self, shard):
+        with self._app.app_context():
+            engine = shard_engines()[shard]
+        while True:
+            try:
+                connection = engine.raw_connection()
+                try:
+                    driver_connection = connection.driver_connection
+                    driver_connection.autocommit = True
+                    driver_connection.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+                    while True:
+                        if select.select([driver_connection], [], [], 5) == ([], [], []):
+                            continue
+                        driver_connection.poll()
+                        while driver_connection.notifies:
+                            notification = driver_connection.notifies.pop(0)
+                            self.publish(json.loads(notification.payload), shard)
+                finally:
+                    connection.invalidate()
+            except Exception:
+                logger.exception('Event hub listener for shard %s lost its connection, reconnecting', shard)
+                time.sleep(1)
+
+    '''
+    Response body for a subscriber. The server closes it when the client
+    leaves, which unsubscribes even if it never started iterating (a
+    generator's finally would only run once started).
+
+    Streams end after max_stream_seconds. EventSource reconnects with
+    Last-Event-ID and gets what it missed, and meanwhile the worker thread
+    (and the stream slot) can go to someone else.
+    '''
+
+    def stream(self, subscriber, replay=(), resync=False):
+        return ClosingIterator(self._events(subscriber, replay, resync), partial(self.unsubscribe, subscriber))
+
+    def _events(self, subscriber, replay, resync):
+        last_seq = 0
+        deadline = time.monotonic() + self.max_stream_seconds
+        yield 'retry: 3000\n\n'
+        for change in replay:
+            last_seq = change['seq']
+            yield format_event(change)
+        if resync:
+            yield 'event: resync\ndata: {}\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                change = subscriber.queue.get(timeout=min(self.heartbeat_interval, remaining))
+            except queue.Empty:
+                yield ': heartbeat\n\n'
+                continue
+            if change is RESYNC:
+                yield 'event: resync\ndata: {}\n\n'
+                continue
+            # Already sent as part of the replay
+            if change['seq'] <= last_seq:
+                continue
+            yield format_event(change)
+
+
+def format_event(change):
+    # Same shape as the /changes endpoint, the stream is already per class
+    data = {key: value for key, value in change.items() if key != 'class_id'}
+    return f'id: {change["seq"]}\nevent: change\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+def _default_backend(app):
+    uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+    if os.environ.get('EVENTS_BACKEND'):
+        return os.environ['EVENTS_BACKEND']
+    return 'postgres' if uri and make_url(uri).get_backend_name() == 'postgresql' else 'memory'
+
+
+def _green():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+
+def _default_max_subscribers(app):
+    # On gevent a stream is a greenlet, past the cap clients get a 503 and
+    # retry rather than queueing for a connection
+    if _green():
+        return app.config['WORKER_CONNECTIONS'] * 9 // 10
+    # On sync workers each stream holds a thread, most are left for normal requests
+    return max(1, app.config['WORKER_THREADS'] // 4)
+
+
+def init_events(app):
+    app.config.setdefault('EVENTS_BACKEND', _default_backend(app))
+    app.config.setdefault('EVENTS_MAX_QUEUE', 100)
+    # Threads per sync worker and connections per gevent worker, the same
+    # settings as gunicorn.conf.py and gunicorn_events.conf.py
+    app.config.setdefault('WORKER_THREADS', int(os.environ.get('WORKER_THREADS', DEFAULT_WORKER_THREADS)))
+    app.config.setdefault('WORKER_CONNECTIONS', int(os.environ.get('WORKER_CONNECTIONS', DEFAULT_WORKER_CONNECTIONS)))
+    app.config.setdefault('EVENTS_MAX_SUBSCRIBERS', _default_max_subscribers(app))
+    app.config.setdefault('EVENTS_MAX_STREAM_SECONDS', 300)
+    app.config.setdefault('EVENTS_HEARTBEAT_INTERVAL', 15)
+    # The memory hub only reaches the streams of the process that handled
+    # the write, gunicorn.conf.py exports its worker count
+    if app.config['EVENTS_BACKEND'] == 'memory' and int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+        raise RuntimeError('EVENTS_BACKEND memory does not reach other workers, '
+                           'use postgres when WEB_CONCURRENCY is over 1')
+    app.extensions['events'] = EventHub(app)
+
+
+def get_hub() -> EventHub:
+    return current_app.extensions['events']
+
+### PUBLISHING ###
+
+
+'''
+Called from the change log listener with the rows it just wrote. NOTIFY
+is transactional on Postgres so it can be sent right away, otherwise the
+events wait in session.info until the transaction commits.
+'''
+
+
+def publish_changes(session, changes):
+    hub = current_app.extensions.get('events')
+    if hub is None or not changes:
+        return
+
+    if hub.backend == 'postgres':
+        connection = session.connection()
+        for change in changes:
+            payload = json.dumps(change, default=str)
+            # NOTIFY payloads must stay under 8000 bytes, clients fetch the
+            # row from /changes instead
+            if len(payload) > MAX_NOTIFY_PAYLOAD:
+                payload = json.dumps(dict(change, data=None, truncated=True), default=str)
+            connection.execute(text('SELECT pg_notify(:channel, :payload)'),
+                               {'channel': NOTIFY_CHANNEL, 'payload': payload})
+    else:
+        shard = current_shard()
+        session.info.setdefault('pending_events', []).extend((shard, change) for change in changes)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_pending(session):
+    pending = session.info.pop('pending_events', None)
+    if pending:
+        hub = get_hub()
+        for shard, change in pending:
+            hub.publish(change, shard)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop('pending_events', None)
@@ -0,0 +1,183 @@
+import importlib.util
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from project import db
+from project.adapted.sharding import shard_names, use_shard
+from project.adapted.streams import ChunkSink
+from project.models import Student, Enrollment, Class, Grade, GradeType, SubjectType, validate_school_year
+
+# pyarrow is slow to import, so it is only loaded by the first export
+pa = None
+pq = None
+
+EXPORT_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+DEFAULT_BATCH_SIZE = 10000
+
+SUBJECTS = [str(subject) for subject in SubjectType]
+GRADE_TYPES = [str(grade_type) for grade_type in GradeType]
+
+
+class ExportUnavailable(RuntimeError):
+    pass
+
+
+def export_available():
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def _require_arrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ExportUnavailable('pyarrow is required for gradebook exports')
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def grade_export_schema():
+    # subject and grade_type use fixed dictionaries so every batch shares them
+    return pa.schema([
+        ('school_id', pa.int64()),
+        ('grade_id', pa.int64()),
+        ('student_id', pa.int64()),
+        ('first_name', pa.string()),
+        ('last_name', pa.string()),
+        ('enrollment_id', pa.int64()),
+        ('class_id', pa.int64()),
+        ('class_name', pa.string()),
+        ('teacher_id', pa.int64()),
+        ('school_year', pa.string()),
+        ('subject', pa.dictionary(pa.int8(), pa.string())),
+        ('grade_type', pa.dictionary(pa.int8(), pa.string())),
+        ('date', pa.date32()),
+        ('grade_value', pa.float64()),
+    ])
+
+
+'''
+One row per grade per class the student was enrolled in that school year
+'''
+
+
+def grade_export_query(school_year):
+    return (
+        select(
+            Class.school_id, Grade.id, Student.id, Student.first_name, Student.last_name,
+            Enrollment.id, Class.id, Class.name, Class.teacher_id, Class.school_year,
+            Grade.subject, Grade.grade_type, Grade.date, Grade.grade_value
+        )
+        .join(Student, Student.id == Grade.student_id)
+        .join(Enrollment, Enrollment.student_id == Student.id)
+        .join(Class, Class.id == Enrollment.class_id)
+        .where(Class.school_year == school_year)
+        .where(*Grade.in_school_year(school_year))
+        .order_by(Class.id, Student.id, Grade.date, Grade.id)
+    )
+
+
+def _dictionary_column(values, dictionary):
+    index = {value: i for i, value in enumerate(dictionary)}
+    indices = pa.array(
+        [None if value is None else index[str(value)] for value in values], type=pa.int8())
+    return pa.DictionaryArray.from_arrays(indices, pa.array(dictionary, type=pa.string()))
+
+
+def _record_batch(rows, schema):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        if field.name == 'subject':
+            arrays.append(_dictionary_column(values, SUBJECTS))
+        elif field.name == 'grade_type':
+            arrays.append(_dictionary_column(values, GRADE_TYPES))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+'''
+Reads the export query through a server side cursor (yield_per) so at
+most batch_size rows are held in memory at once. Shards are read one
+after the other, ids only make sense together with school_id.
+'''
+
+
+def iter_grade_batches(school_year, batch_size=DEFAULT_BATCH_SIZE):
+    _require_arrow()
+    schema = grade_export_schema()
+    for shard in shard_names():
+        with use_shard(shard):
+            result = db.session.execute(
+                grade_export_query(school_year).execution_options(yield_per=batch_size))
+            for rows in result.partitions():
+                yield _record_batch(rows, schema)
+
+
+def _open_writer(sink, fmt):
+    _require_arrow()
+    schema = grade_export_schema()
+    if fmt == 'parquet':
+        return pq.ParquetWriter(sink, schema, compression='zstd', use_dictionary=['subject', 'grade_type', 'school_year', 'class_name'])
+    if fmt == 'arrow':
+        return pa.ipc.new_stream(sink, schema)
+    raise ValueError(f'Invalid export format {fmt}')
+
+
+def write_grade_export(school_year, sink, fmt='parquet', batch_size=DEFAULT_BATCH_SIZE):
+    rows = 0
+    with _open_writer(sink, fmt) as writer:
+        for batch in iter_grade_batches(school_year, batch_size):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    return rows
+
+
+'''
+Yields the export file in pieces as each batch is written, for use in a
+streamed download response
+'''
+
+
+def stream_grade_export(school_year, fmt='parquet', batch_size=DEFAULT_BATCH_SIZE):
+    sink = ChunkSink()
+    writer = _open_writer(sink, fmt)
+    try:
+        for batch in iter_grade_batches(school_year, batch_size):
+            writer.write_batch(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+@click.command('export-grades')
+@click.argument('school_year')
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='parquet')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None)
+@click.option('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+@with_appcontext
+def export_grades_command(school_year, fmt, output, batch_size):
+    '''Export every grade for SCHOOL_YEAR (YYYY-YYYY).'''
+    try:
+        validate_school_year(school_year)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='SCHOOL_YEAR')
+
+    output = output or f'grades_{school_year}.{EXPORT_FORMATS[fmt][1]}'
+    try:
+        with open(output, 'wb') as sink:
+            rows = write_grade_export(school_year, sink, fmt, batch_size)
+    except ExportUnavailable as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Wrote {rows} grades to {output}')
@@ -0,0 +1,51 @@
+from flask import Flask
+from flask_cors import CORS
+
+from project import db
+from project.connect_unix import get_connect_url, get_shard_urls
+from project.adapted.admission import init_admission
+from project.adapted.analytics_cache import init_analytics_cache
+from project.adapted.compression import init_compression
+from project.adapted.events import init_events
+from project.adapted.export import export_grades_command
+from project.adapted.partitions import grades_cli
+from project.adapted.reports import report_cards_command
+from project.adapted.sharding import init_sharding
+from project.adapted.views import index_blueprint
+from project.init_db import create_db_command, init_db_command
+
+
+'''
+Builds the app without touching the database. The engine only opens a
+connection on the first query, and resetting/seeding the database is
+left to the init-db command.
+'''
+
+
+def create_app(config=None):
+    application = Flask('project')
+    CORS(application)
+    # Talisman(app, content_security_policy=None)
+
+    application.config["SQLALCHEMY_DATABASE_URI"] = get_connect_url()
+    application.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    application.config["SHARDS"] = get_shard_urls()
+    if config:
+        application.config.update(config)
+
+    # Before db.init_app, they pick the pool and the shard engines
+    init_admission(application)
+    init_sharding(application)
+    db.init_app(application)
+
+    application.register_blueprint(index_blueprint, url_prefix='/')
+    init_compression(application)
+    init_events(application)
+    init_analytics_cache(application)
+
+    application.cli.add_command(init_db_command)
+    application.cli.add_command(create_db_command)
+    application.cli.add_command(export_grades_command)
+    application.cli.add_command(grades_cli)
+    application.cli.add_command(report_cards_command)
+    return application
@@ -0,0 +1,117 @@
+from flask import g, abort
+from sqlalchemy import inspect
+
+from project import db
+from project.adapted.sharding import current_school_id, current_shard
+from project.adapted.statements import entities_by_key
+
+MAX_KEYS_PER_QUERY = 500
+
+
+'''
+Request scoped, DataLoader style entity loader. Keys are queued with
+prime() and the next load() fetches every queued key with a single IN
+query. Results (including misses) are kept for the rest of the request
+so repeat lookups never go back to the database.
+
+Schools can share a shard, so the query only matches rows of the
+request's school (see in_school on the models). Rows of other schools
+are misses like any unknown id, lookups and FK checks never reach past
+the school in X-School-ID.
+'''
+
+
+class EntityLoader:
+    def __init__(self, model, school_id):
+        self.model = model
+        self.school_id = school_id
+        self._python_type = model.id.type.python_type
+        self._loaded = {}
+        self._pending = set()
+
+    def _normalize(self, key):
+        # Ids from request.json may be strings. Handlers store the raw value
+        # once the lookup passes, so anything that isn't exactly an id
+        # (1.5, "1.5", [1]) is a miss rather than being rounded to one.
+        if key is None or isinstance(key, bool):
+            return None
+        if self._python_type is not int:
+            return key if isinstance(key, self._python_type) else None
+        if isinstance(key, int):
+            return key
+        if isinstance(key, float):
+            return int(key) if key.is_integer() else None
+        if isinstance(key, str) and key.isascii() and key.isdigit():
+            return int(key)
+        return None
+
+    def _from_identity_map(self, key):
+        # Only rows that carry their own school_id can be checked without a query
+        if not hasattr(self.model, 'school_id'):
+            return None
+        identity_key = db.session.identity_key(self.model, key, identity_token=current_shard())
+        instance = db.session.identity_map.get(identity_key)
+        # Expired rows would be refreshed with a query anyway (and may be gone)
+        if instance is None or instance in db.session.deleted or 'school_id' in inspect(instance).unloaded:
+            return None
+        return instance if instance.school_id == self.school_id else None
+
+    def prime(self, keys):
+        for key in keys:
+            key = self._normalize(key)
+            if key is not None and key not in self._loaded:
+                self._pending.add(key)
+        return self
+
+    def load(self, key):
+        key = self._normalize(key)
+        if key is None:
+            return None
+        if key not in self._loaded:
+            self._pending.add(key)
+            self._dispatch()
+        return self._loaded[key]
+
+    def load_many(self, keys):
+        self.prime(keys)
+        return [self.load(key) for key in keys]
+
+    def _dispatch(self):
+        keys = []
+        for key in self._pending:
+            instance = self._from_identity_map(key)
+            if instance is not None:
+                self._loaded[key] = instance
+            else:
+                keys.append(key)
+        self._pending = set()
+        for i in range(0, len(keys), MAX_KEYS_PER_QUERY):
+            chunk = keys[i:i + MAX_KEYS_PER_QUERY]
+            results = dict.fromkeys(chunk)
+            params = {'keys': chunk, 'school_id': self.school_id}
+            for row in db.session.execute(entities_by_key(self.model), params).scalars():
+                results[row.id] = row
+            self._loaded.update(results)
+
+
+def get_loader(model) -> EntityLoader:
+    loaders = g.setdefault('entity_loaders', {})
+    key = (model, current_school_id())
+    if key not in loaders:
+        loaders[key] = EntityLoader(model, key[1])
+    return loaders[key]
+
+
+def load(model, key):
+    return get_loader(model).load(key)
+
+
+def load_many(model, keys):
+    return get_loader(model).load_many(keys)
+
+
+def load_or_404(model, key):
+    instance = load(model, key)
+    if instance is None:
+        abort(404)
+    return instance
@@ -0,0 +1,213 @@
+import gzip
+import json
+import os
+from datetime import date
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import PrimaryKeyConstraint, delete, event, select, text
+from sqlalchemy.ext.compiler import compiles
+
+from project.adapted.sharding import shard_engines
+from project.models import Grade, school_year_bounds, validate_school_year
+
+DEFAULT_PARTITION = 'grade_default'
+
+grades_cli = AppGroup('grades', help='Manage school year partitions of the grade table.')
+
+
+'''
+Postgres requires the partition key in the primary key of a partitioned
+table. The ORM keeps `id` as the identity, only the DDL gets the key.
+SQLite (and anything else) keeps a plain autoincrementing id.
+'''
+
+
+@compiles(PrimaryKeyConstraint, 'postgresql')
+def _partitioned_primary_key(constraint, compiler, **kw):
+    partition_key = constraint.table.info.get('partition_key')
+    if partition_key is None or partition_key in constraint.columns.keys():
+        return compiler.visit_primary_key_constraint(constraint, **kw)
+
+    columns = [column.name for column in constraint.columns] + [partition_key]
+    return 'PRIMARY KEY (%s)' % ', '.join(compiler.preparer.quote(column) for column in columns)
+
+
+@event.listens_for(Grade.__table__, 'after_create')
+def _create_partitions(table, connection, **kw):
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {table.name} DEFAULT'))
+        for school_year in upcoming_school_years():
+            create_partition(connection, school_year)
+
+
+def partition_name(school_year):
+    return 'grade_' + school_year.replace('-', '_')
+
+
+def upcoming_school_years(today=None):
+    # The current school year and the next one
+    today = today or date.today()
+    start_year = today.year if today.month >= 8 else today.year - 1
+    return [f'{year}-{year + 1}' for year in (start_year, start_year + 1)]
+
+
+def is_partitioned(connection):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('grade')")).first() is not None
+
+
+def is_unpartitioned_postgres(connection):
+    # A grade table created before partitioning, create_all leaves it as it is
+    if connection.dialect.name != 'postgresql' or is_partitioned(connection):
+        return False
+    return connection.execute(text("SELECT to_regclass('grade') IS NOT NULL")).scalar()
+
+
+def partition_exists(connection, school_year):
+    return connection.execute(text(
+        f"SELECT to_regclass('{partition_name(school_year)}') IS NOT NULL")).scalar()
+
+
+'''
+Creates the partition for a school year and returns how many grades were
+moved into it. Postgres refuses to add a partition while the default
+partition holds rows in its range, so those are moved over with the
+default partition detached. grade is locked until the transaction ends.
+'''
+
+
+def create_partition(connection, school_year):
+    name = partition_name(school_year)
+    if partition_exists(connection, school_year):
+        return 0
+
+    start, end = school_year_bounds(school_year)
+    bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    in_range = f"date >= '{start.isoformat()}' AND date < '{end.isoformat()}'"
+    has_default = connection.execute(text(f"SELECT to_regclass('{DEFAULT_PARTITION}') IS NOT NULL")).scalar()
+    if not has_default or connection.execute(text(
+            f'SELECT NOT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range})')).scalar():
+        connection.execute(text(f'CREATE TABLE {name} PARTITION OF grade {bounds}'))
+        return 0
+
+    connection.execute(text(f'ALTER TABLE grade DETACH PARTITION {DEFAULT_PARTITION}'))
+    connection.execute(text(f'CREATE TABLE {name} PARTITION OF grade {bounds}'))
+    moved = connection.execute(text(f'INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_range}')).rowcount
+    connection.execute(text(f'DELETE FROM {DEFAULT_PARTITION} WHERE {in_range}'))
+    connection.execute(text(f'ALTER TABLE grade ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT'))
+    return moved
+
+
+def create_upcoming_partitions(connection):
+    # Run on every deploy (create-db), so the next school year always has its partition ready
+    if not is_partitioned(connection):
+        return []
+    return [(partition_name(school_year), create_partition(connection, school_year))
+            for school_year in upcoming_school_years() if not partition_exists(connection, school_year)]
+
+
+def detach_partition(connection, school_year, tablespace=None):
+    name = partition_name(school_year)
+    connection.execute(text(f'ALTER TABLE grade DETACH PARTITION {name}'))
+    if tablespace:
+        connection.execute(text(f'ALTER TABLE {name} SET TABLESPACE {tablespace}'))
+    return name
+
+
+'''
+Writes every grade of a school year to a gzipped JSON lines file and
+deletes them from the grade table in the same transaction
+'''
+
+
+def archive_to_file(connection, school_year, output_dir, batch_size=10000):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f'grades_{school_year}.jsonl.gz')
+    columns = [Grade.id, Grade.student_id, Grade.grade_type, Grade.grade_value, Grade.date, Grade.subject]
+    criteria = Grade.in_school_year(school_year)
+
+    rows = 0
+    result = connection.execution_options(yield_per=batch_size).execute(
+        select(*columns).where(*criteria).order_by(Grade.id))
+    with gzip.open(path, 'wt', encoding='utf-8') as archive:
+        for row in result:
+            grade = dict(row._mapping)
+            grade['date'] = grade['date'].isoformat()
+            grade['grade_type'] = str(grade['grade_type']) if grade['grade_type'] else None
+            grade['subject'] = str(grade['subject']) if grade['subject'] else None
+            archive.write(json.dumps(grade) + '\n')
+            rows += 1
+
+    connection.execute(delete(Grade).where(*criteria))
+    return path, rows
+
+
+def _validate_closed_school_year(school_year, force):
+    try:
+        validate_school_year(school_year)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='SCHOOL_YEAR')
+    _, end = school_year_bounds(school_year)
+    if end > date.today() and not force:
+        raise click.ClickException(f'{school_year} has not ended yet, use --force to archive it anyway')
+
+
+@grades_cli.command('create-partition')
+@click.argument('school_year')
+def create_partition_command(school_year):
+    '''Create the grade partition for SCHOOL_YEAR (YYYY-YYYY).'''
+    try:
+        validate_school_year(school_year)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='SCHOOL_YEAR')
+
+    name = partition_name(school_year)
+    for shard, engine in shard_engines().items():
+        with engine.begin() as connection:
+            if not is_partitioned(connection):
+                raise click.ClickException(f'The grade table is not partitioned on shard {shard}')
+            if partition_exists(connection, school_year):
+                click.echo(f'{name} already exists on shard {shard}')
+                continue
+            moved = create_partition(connection, school_year)
+        click.echo(f'Created {name} on shard {shard}' + (f', moved {moved} grades out of {DEFAULT_PARTITION}' if moved else ''))
+
+
+@grades_cli.command('archive')
+@click.argument('school_year')
+@click.option('--output-dir', type=click.Path(file_okay=False), default=None,
+              help='Move the grades into a compressed file in this directory.')
+@click.option('--tablespace', default=None,
+              help='Move the detached partition to this (cold) tablespace.')
+@click.option('--force', is_flag=True, help='Archive a school year that has not ended.')
+def archive_command(school_year, output_dir, tablespace, force):
+    '''Move the grades of a closed SCHOOL_YEAR out of the hot grade table.'''
+    _validate_closed_school_year(school_year, force)
+
+    engines = shard_engines()
+    for shard, engine in engines.items():
+        with engine.begin() as connection:
+            if output_dir is None:
+                if not is_partitioned(connection):
+                    raise click.ClickException(f'The grade table is not partitioned on shard {shard}, use --output-dir')
+                if not partition_exists(connection, school_year):
+                    raise click.ClickException(
+                        f'There is no {partition_name(school_year)} partition on shard {shard}. Run '
+                        f'flask grades create-partition {school_year} first, or use --output-dir')
+                name = detach_partition(connection, school_year, tablespace)
+                message = f'Detached {name}' + (f' into tablespace {tablespace}' if tablespace else '')
+            else:
+                # One file per shard, grade ids repeat across shards
+                directory = os.path.join(output_dir, shard) if len(engines) > 1 else output_dir
+                path, rows = archive_to_file(connection, school_year, directory)
+                if is_partitioned(connection) and partition_exists(connection, school_year):
+                    detach_partition(connection, school_year)
+                    connection.execute(text(f'DROP TABLE {partition_name(school_year)}'))
+                message = f'Archived {rows} grades to {path}'
+        click.echo(f'{message} on shard {shard}')
+    # The servers' analytics caches are per process, they drop the archived
+    # grades once their entries expire (ANALYTICS_CACHE_TTL)
@@ -0,0 +1,118 @@
+from typing import NamedTuple, Optional
+from datetime import date
+
+from project import db
+from project.adapted.statements import (
+    ENROLLED_STUDENTS, IEPS_BY_STUDENT, GRADES_BY_STUDENT, CLASS_LESSON_PLANS, LESSON_PLAN_ACCOMMODATIONS)
+from project.models import SubjectType, school_year_bounds
+
+STREAM_BATCH_SIZE = 1000
+
+
+'''
+Read models for the hot GET endpoints. Rows come from the Core select()
+projections in statements.py straight into named tuples, skipping ORM
+instances (identity map, attribute instrumentation, lazy loaders) that
+the handlers would only copy a few fields out of.
+'''
+
+
+class StudentRow(NamedTuple):
+    id: int
+    first_name: str
+    last_name: str
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "first_name": self.first_name,
+            "last_name": self.last_name
+        }
+
+
+class IEPRow(NamedTuple):
+    student_id: int
+    description: str
+    disability: str
+
+    def to_json(self):
+        return {
+            "description": self.description,
+            "disability": self.disability
+        }
+
+
+class LessonPlanRow(NamedTuple):
+    id: int
+    name: str
+    date: date
+    overview: str
+    objective: str
+    subject: Optional[SubjectType]
+
+    def to_json(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "date": self.date,
+            "overview": self.overview,
+            "objective": self.objective,
+            "subject": str(self.subject)
+        }
+
+
+class AccommodationRow(NamedTuple):
+    id: int
+    text: str
+    student: StudentRow
+
+    def to_json(self):
+        return {"text": self.text, "id": self.id}
+
+
+def _rows(statement, params, row_type):
+    return [row_type._make(row) for row in db.session.execute(statement, params)]
+
+
+def enrolled_students(class_id) -> list[StudentRow]:
+    return _rows(ENROLLED_STUDENTS, {'class_id': class_id}, StudentRow)
+
+
+# Matches IEP.query.filter_by(student_id=...).first(), the lowest id wins
+def first_ieps(student_ids) -> dict[int, IEPRow]:
+    ieps = {}
+    if not student_ids:
+        return ieps
+    for iep in _rows(IEPS_BY_STUDENT, {'student_ids': student_ids}, IEPRow):
+        ieps[iep.student_id] = iep
+    return ieps
+
+
+# Rows go straight into their response dicts as they stream in, so no
+# row objects for the whole gradebook are held next to the response
+def grades_by_student(student_ids, school_year) -> dict[int, list[dict]]:
+    grades = {student_id: [] for student_id in student_ids}
+    if not student_ids:
+        return grades
+    start, end = school_year_bounds(school_year)
+    params = {'student_ids': student_ids, 'start': start, 'end': end}
+    rows = db.session.execute(GRADES_BY_STUDENT, params, execution_options={'yield_per': STREAM_BATCH_SIZE})
+    for student_id, id, subject, grade_type, grade_date, grade_value in rows:
+        grades[student_id].append({
+            "id": id,
+            "subject": str(subject),
+            "grade_type": str(grade_type),
+            "date": grade_date,
+            "grade_value": grade_value
+        })
+    return grades
+
+
+def class_lesson_plans(class_id) -> list[LessonPlanRow]:
+    return _rows(CLASS_LESSON_PLANS, {'class_id': class_id}, LessonPlanRow)
+
+
+def lesson_plan_accommodations(lesson_plan_id) -> list[AccommodationRow]:
+    rows = db.session.execute(LESSON_PLAN_ACCOMMODATIONS, {'lesson_plan_id': lesson_plan_id})
+    return [AccommodationRow(id, text, StudentRow(student_id, first_name, last_name))
+            for id, text, student_id, first_name, last_name in rows]
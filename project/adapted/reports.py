@@ -0,0 +1,330 @@
+import importlib.util
+import multiprocessing
+import os
+import re
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from itertools import islice
+from typing import NamedTuple, Optional
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from project import db
+from project.adapted.sharding import scatter_gather
+from project.adapted.streams import ChunkSink
+from project.models import (
+    Teacher, Student, IEP, Enrollment, Class, LessonPlan, Grade, Accommodation, validate_school_year)
+
+REPORT_FORMATS = {
+    'html': ('text/html', 'html'),
+    'pdf': ('application/pdf', 'pdf'),
+}
+
+# Students per task sent to a worker, large enough to amortize pickling
+DEFAULT_BATCH_SIZE = 50
+# Batches submitted to the pool ahead of the one being streamed
+MAX_BATCHES_PER_WORKER = 2
+
+
+class ReportUnavailable(RuntimeError):
+    pass
+
+
+def report_available(fmt):
+    if fmt == 'pdf':
+        return importlib.util.find_spec('weasyprint') is not None
+    return fmt in REPORT_FORMATS
+
+### REPORT DATA ###
+
+
+'''
+Plain tuples only, every report is pickled over to a worker process
+'''
+
+
+class ReportGrade(NamedTuple):
+    subject: str
+    grade_type: str
+    date: date
+    grade_value: Optional[float]
+
+
+class ReportIEP(NamedTuple):
+    description: str
+    disability: str
+    start_date: Optional[date]
+
+
+class ReportAccommodation(NamedTuple):
+    lesson_plan: str
+    date: Optional[date]
+    text: str
+
+
+class ReportClass(NamedTuple):
+    name: str
+    teacher: str
+
+
+class ReportCard(NamedTuple):
+    school_id: int
+    student_id: int
+    first_name: str
+    last_name: str
+    school_year: str
+    classes: list
+    grades: list
+    ieps: list
+    accommodations: list
+
+    @property
+    def filename(self):
+        # Student ids are per shard, the school folder keeps names unique
+        name = re.sub(r'[^A-Za-z0-9]+', '_', f'{self.last_name}_{self.first_name}').strip('_')
+        return f'school_{self.school_id}/' + (f'{name}_{self.student_id}' if name else str(self.student_id))
+
+
+def _scope(school_year, class_id=None, school_id=None):
+    criteria = [Class.school_year == school_year]
+    if class_id is not None:
+        criteria.append(Class.id == class_id)
+    if school_id is not None:
+        criteria.append(Class.in_school(school_id))
+    return criteria
+
+
+'''
+Loads everything the report cards for a class, a school or the whole
+district (neither given) need in four queries per shard, however many
+students there are. A class or school is read from the request's shard.
+The student ids stay in a subquery so large schools don't hit bind
+parameter limits.
+'''
+
+
+def load_report_cards(school_year, class_id=None, school_id=None) -> list[ReportCard]:
+    if class_id is not None or school_id is not None:
+        return _load_shard_report_cards(school_year, class_id, school_id)
+    return [card for _, cards in scatter_gather(_load_shard_report_cards, school_year) for card in cards]
+
+
+def _load_shard_report_cards(school_year, class_id=None, school_id=None):
+    scope = _scope(school_year, class_id, school_id)
+    enrolled = select(Enrollment.student_id).join(Class, Class.id == Enrollment.class_id).where(*scope)
+
+    cards = {}
+    rows = db.session.execute(
+        select(Student.school_id, Student.id, Student.first_name, Student.last_name, Class.name,
+               Teacher.first_name, Teacher.last_name)
+        .join(Enrollment, Enrollment.student_id == Student.id)
+        .join(Class, Class.id == Enrollment.class_id)
+        .outerjoin(Teacher, Teacher.id == Class.teacher_id)
+        .where(*scope)
+        .order_by(Student.last_name, Student.first_name, Student.id, Class.name))
+    for school_id, student_id, first_name, last_name, class_name, teacher_first, teacher_last in rows:
+        card = cards.get(student_id)
+        if card is None:
+            card = cards[student_id] = ReportCard(
+                school_id, student_id, first_name, last_name, school_year, [], [], [], [])
+        teacher = ' '.join(name for name in (teacher_first, teacher_last) if name)
+        card.classes.append(ReportClass(class_name, teacher))
+
+    for student_id, subject, grade_type, grade_date, grade_value in db.session.execute(
+            select(Grade.student_id, Grade.subject, Grade.grade_type, Grade.date, Grade.grade_value)
+            .where(Grade.student_id.in_(enrolled), *Grade.in_school_year(school_year))
+            .order_by(Grade.date, Grade.id)):
+        # Enrollments committed after the first query have no card, they
+        # make the next run
+        if student_id in cards:
+            cards[student_id].grades.append(ReportGrade(
+                str(subject) if subject else '', str(grade_type) if grade_type else '', grade_date, grade_value))
+
+    for student_id, description, disability, start_date in db.session.execute(
+            select(IEP.student_id, IEP.description, IEP.disability, IEP.start_date)
+            .where(IEP.student_id.in_(enrolled))
+            .order_by(IEP.id)):
+        if student_id in cards:
+            cards[student_id].ieps.append(ReportIEP(description, disability, start_date))
+
+    for student_id, lesson_plan, lesson_date, text in db.session.execute(
+            select(Accommodation.student_id, LessonPlan.name, LessonPlan.date, Accommodation.text)
+            .join(LessonPlan, LessonPlan.id == Accommodation.lesson_plan_id)
+            .join(Class, Class.id == LessonPlan.class_id)
+            .where(Accommodation.student_id.in_(enrolled), *scope)
+            .order_by(LessonPlan.date, Accommodation.id)):
+        if student_id in cards:
+            cards[student_id].accommodations.append(ReportAccommodation(lesson_plan, lesson_date, text))
+
+    return list(cards.values())
+
+### RENDERING ###
+
+
+REPORT_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Report card: {{ card.first_name }} {{ card.last_name }} {{ card.school_year }}</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+table { border-collapse: collapse; margin-bottom: 1.5em; }
+th, td { border: 1px solid #999; padding: 0.25em 0.75em; text-align: left; }
+</style>
+</head>
+<body>
+<h1>{{ card.first_name }} {{ card.last_name }}</h1>
+<p>School year {{ card.school_year }}</p>
+<h2>Classes</h2>
+<table>
+<tr><th>Class</th><th>Teacher</th></tr>
+{% for class in card.classes %}<tr><td>{{ class.name }}</td><td>{{ class.teacher }}</td></tr>
+{% endfor %}</table>
+<h2>Summary</h2>
+<table>
+<tr><th>Subject</th><th>Grades</th><th>Average</th></tr>
+{% for subject, count, average in summary %}<tr><td>{{ subject }}</td><td>{{ count }}</td><td>{{ '%.1f' % average }}</td></tr>
+{% else %}<tr><td colspan="3">No grades recorded</td></tr>
+{% endfor %}</table>
+<h2>Grades</h2>
+<table>
+<tr><th>Date</th><th>Subject</th><th>Type</th><th>Grade</th></tr>
+{% for grade in card.grades %}<tr><td>{{ grade.date }}</td><td>{{ grade.subject }}</td><td>{{ grade.grade_type }}</td><td>{{ grade.grade_value if grade.grade_value is not none else '' }}</td></tr>
+{% endfor %}</table>
+{% if card.ieps %}<h2>IEP</h2>
+<table>
+<tr><th>Disability</th><th>Description</th><th>Start date</th></tr>
+{% for iep in card.ieps %}<tr><td>{{ iep.disability }}</td><td>{{ iep.description }}</td><td>{{ iep.start_date or '' }}</td></tr>
+{% endfor %}</table>
+{% endif %}{% if card.accommodations %}<h2>Accommodations</h2>
+<table>
+<tr><th>Date</th><th>Lesson</th><th>Accommodation</th></tr>
+{% for accommodation in card.accommodations %}<tr><td>{{ accommodation.date or '' }}</td><td>{{ accommodation.lesson_plan }}</td><td>{{ accommodation.text }}</td></tr>
+{% endfor %}</table>
+{% endif %}</body>
+</html>
+'''
+
+# Compiled once per process, workers build their own on first use
+_template = None
+
+
+def _get_template():
+    global _template
+    if _template is None:
+        from jinja2 import Environment
+        _template = Environment(autoescape=True).from_string(REPORT_TEMPLATE)
+    return _template
+
+
+def subject_summary(grades):
+    totals = {}
+    for grade in grades:
+        if grade.grade_value is not None:
+            count, total = totals.get(grade.subject, (0, 0.0))
+            totals[grade.subject] = (count + 1, total + grade.grade_value)
+    return [(subject, count, total / count) for subject, (count, total) in sorted(totals.items())]
+
+
+def render_report_card(card: ReportCard, fmt='html') -> bytes:
+    html = _get_template().render(card=card, summary=subject_summary(card.grades))
+    if fmt == 'pdf':
+        try:
+            from weasyprint import HTML
+        except ImportError:
+            raise ReportUnavailable('weasyprint is required for PDF report cards')
+        return HTML(string=html).write_pdf()
+    return html.encode()
+
+
+def render_batch(cards, fmt='html'):
+    # Runs in the worker processes
+    return [(card.filename, render_report_card(card, fmt)) for card in cards]
+
+
+'''
+Yields (filename, document) in the same order as cards. Batches are
+rendered across a process pool when there is more than one worker and
+more than one batch, otherwise in this process.
+'''
+
+
+def render_report_cards(cards, fmt='html', workers=None, batch_size=DEFAULT_BATCH_SIZE):
+    workers = workers or os.cpu_count() or 1
+    batches = [cards[i:i + batch_size] for i in range(0, len(cards), batch_size)]
+    if workers == 1 or len(batches) <= 1:
+        for batch in batches:
+            yield from render_batch(batch, fmt)
+        return
+
+    workers = min(workers, len(batches))
+    # Spawned rather than forked, the web server may have threads holding locks
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    pending = iter(batches)
+    in_flight = deque()
+    try:
+        # Only a couple of batches per worker are queued, so rendered
+        # documents don't pile up when the download is slower than rendering
+        for batch in islice(pending, workers * MAX_BATCHES_PER_WORKER):
+            in_flight.append(executor.submit(render_batch, batch, fmt))
+        while in_flight:
+            rendered = in_flight.popleft().result()
+            for batch in islice(pending, 1):
+                in_flight.append(executor.submit(render_batch, batch, fmt))
+            yield from rendered
+    finally:
+        # Stops rendering if the download is abandoned half way
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+'''
+Yields a zip archive with one document per student, a piece at a time as
+documents are rendered. progress(done, total) is called after each one.
+'''
+
+
+def stream_report_cards(cards, fmt='html', workers=None, progress=None, batch_size=DEFAULT_BATCH_SIZE):
+    sink = ChunkSink()
+    extension = REPORT_FORMATS[fmt][1]
+    # PDFs are compressed already
+    compression = zipfile.ZIP_STORED if fmt == 'pdf' else zipfile.ZIP_DEFLATED
+    total = len(cards)
+    with zipfile.ZipFile(sink, 'w', compression) as archive:
+        for done, (filename, document) in enumerate(render_report_cards(cards, fmt, workers, batch_size), 1):
+            archive.writestr(f'{filename}.{extension}', document)
+            if progress is not None:
+                progress(done, total)
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()
+
+
+@click.command('report-cards')
+@click.argument('school_year')
+@click.option('--class-id', type=int, default=None, help='Only this class instead of the whole school year.')
+@click.option('--format', 'fmt', type=click.Choice(list(REPORT_FORMATS)), default='html')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None)
+@click.option('--workers', type=int, default=None, help='Render processes, defaults to the CPU count.')
+@with_appcontext
+def report_cards_command(school_year, class_id, fmt, output, workers):
+    '''Render report cards for SCHOOL_YEAR (YYYY-YYYY) into a zip archive.'''
+    try:
+        validate_school_year(school_year)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='SCHOOL_YEAR')
+    if not report_available(fmt):
+        raise click.ClickException(f'{fmt} report cards are not available, is weasyprint installed?')
+
+    cards = load_report_cards(school_year, class_id)
+    db.session.remove()
+    suffix = f'_class_{class_id}' if class_id is not None else ''
+    output = output or f'report_cards_{school_year}{suffix}.zip'
+    with open(output, 'wb') as sink, click.progressbar(length=len(cards), label='Rendering report cards') as bar:
+        for data in stream_report_cards(cards, fmt, workers, progress=lambda done, total: bar.update(1)):
+            sink.write(data)
+    click.echo(f'Wrote {len(cards)} report cards to {output}')
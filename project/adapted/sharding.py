@@ -0,0 +1,238 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy.ext.horizontal_shard import ShardedSession as _ShardedSession
+
+# Only imports Flask and SQLAlchemy, project/__init__.py needs the session
+# class before db (and so the models) exist
+
+DEFAULT_SHARD = 'default'
+DEFAULT_SCHOOL_ID = 1
+SCHOOL_HEADER = 'X-School-ID'
+
+# Admin endpoints that gather from every shard themselves
+DEFAULT_SCATTER_ENDPOINTS = {
+    'index_page.hello_world',
+    'index_page.statement_cache_metrics',
+    'index_page.admission_metrics',
+    'index_page.district_grade_analytics',
+    'index_page.export_grades',
+}
+
+
+class ShardRequired(RuntimeError):
+    pass
+
+
+'''
+Schools (the tenant key on Teacher, Student and Class) are assigned to
+shards through SHARD_SCHOOLS, anything not listed lives on the default
+shard (SQLALCHEMY_DATABASE_URI). Ids are only unique within a shard, so
+each request has to say which school it is for.
+'''
+
+
+class ShardRouter:
+    def __init__(self, app):
+        self.shard_names = [DEFAULT_SHARD] + [name for name in app.config['SHARDS'] if name != DEFAULT_SHARD]
+        self.schools = {int(school_id): shard for school_id, shard in app.config['SHARD_SCHOOLS'].items()}
+        unknown = set(self.schools.values()) - set(self.shard_names)
+        if unknown:
+            raise ValueError(f'SHARD_SCHOOLS refers to unknown shards: {", ".join(sorted(unknown))}')
+        self.scatter_endpoints = set(app.config['SHARD_SCATTER_ENDPOINTS'])
+
+    @property
+    def sharded(self):
+        return len(self.shard_names) > 1
+
+    def bind_key(self, shard):
+        return None if shard == DEFAULT_SHARD else shard
+
+    def shard_for_school(self, school_id):
+        return self.schools.get(school_id, DEFAULT_SHARD)
+
+    def current_shard(self, required=False):
+        shard = g.get('shard') if has_app_context() else None
+        if shard is None and not self.sharded:
+            shard = DEFAULT_SHARD
+        if shard is None and required:
+            raise ShardRequired(f'Missing school ID. Please send the {SCHOOL_HEADER} header')
+        return shard
+
+    def current_shards(self):
+        shard = self.current_shard()
+        return [shard] if shard is not None else self.shard_names
+
+    ### SESSION CHOOSERS ###
+
+    def choose_shard(self, mapper, instance, clause=None):
+        # Tenant rows go where their school lives, the column default
+        # applies to rows created without one
+        if instance is not None and hasattr(type(instance), 'school_id'):
+            return self.shard_for_school(instance.school_id or DEFAULT_SCHOOL_ID)
+        return self.current_shard(required=True)
+
+    def choose_identity_shards(self, mapper, primary_key, *, lazy_loaded_from=None, **kw):
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        return self.current_shards()
+
+    def choose_execute_shards(self, orm_context):
+        # Only SELECTs have load options, bulk UPDATEs go to the current shard
+        if orm_context.is_select and orm_context.lazy_loaded_from is not None:
+            return [orm_context.lazy_loaded_from.identity_token]
+        return self.current_shards()
+
+    ### REQUEST ROUTING ###
+
+    def before_request(self):
+        g.shard = None
+        g.school_id = None
+        if request.endpoint is None:
+            return None
+        try:
+            g.school_id = requested_school_id()
+        except (TypeError, ValueError):
+            return {'error': 'Invalid school ID'}, 400
+
+        if request.endpoint in self.scatter_endpoints:
+            return None
+        if g.school_id is not None:
+            g.shard = self.shard_for_school(g.school_id)
+        elif not self.sharded:
+            g.shard = DEFAULT_SHARD
+        else:
+            return {'error': f'Missing school ID. Please send the {SCHOOL_HEADER} header'}, 400
+        return None
+
+
+def requested_school_id():
+    # Header first, creates can also name the school in their body
+    school_id = request.headers.get(SCHOOL_HEADER) or request.args.get('school_id')
+    if school_id is None and request.is_json:
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            school_id = body.get('school_id')
+    if school_id is None or isinstance(school_id, bool):
+        return None
+    return int(school_id)
+
+
+'''
+Session for db (see project/__init__.py). ORM statements run on the
+request's shard, or on every shard with the results concatenated when
+there is none. Instances are flushed to their school's shard. Core
+statements and session.connection() use the request's shard.
+'''
+
+
+class ShardedSession(_ShardedSession):
+    def __init__(self, db, **kwargs):
+        self.router = get_router()
+        super().__init__(
+            shard_chooser=self.router.choose_shard,
+            identity_chooser=self.router.choose_identity_shards,
+            execute_chooser=self.router.choose_execute_shards,
+            shards={shard: db.engines[self.router.bind_key(shard)] for shard in self.router.shard_names},
+            **kwargs)
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kw):
+        if shard_id is None and mapper is None and instance is None:
+            shard_id = self.router.current_shard(required=True)
+        return super().get_bind(mapper, shard_id=shard_id, instance=instance, clause=clause, **kw)
+
+
+def init_sharding(app):
+    # Extra shards, name -> database URL
+    app.config.setdefault('SHARDS', {})
+    # School id -> shard name
+    app.config.setdefault('SHARD_SCHOOLS', {})
+    app.config.setdefault('SHARD_SCATTER_ENDPOINTS', DEFAULT_SCATTER_ENDPOINTS)
+
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update((name, url) for name, url in app.config['SHARDS'].items() if name != DEFAULT_SHARD)
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+    router = ShardRouter(app)
+    app.extensions['sharding'] = router
+    app.before_request(router.before_request)
+    app.register_error_handler(ShardRequired, lambda e: ({'error': str(e)}, 400))
+
+
+def get_router() -> ShardRouter:
+    return current_app.extensions['sharding']
+
+
+def current_shard():
+    return get_router().current_shard()
+
+
+def current_school_id():
+    school_id = g.get('school_id')
+    return DEFAULT_SCHOOL_ID if school_id is None else school_id
+
+
+def shard_names():
+    return get_router().shard_names
+
+
+def shard_engines():
+    router = get_router()
+    db = current_app.extensions['sqlalchemy']
+    return {shard: db.engines[router.bind_key(shard)] for shard in router.shard_names}
+
+
+def set_shard(shard):
+    g.shard = shard
+
+
+@contextmanager
+def use_shard(shard):
+    previous = g.get('shard')
+    g.shard = shard
+    try:
+        yield
+    finally:
+        g.shard = previous
+
+### SCATTER GATHER ###
+
+
+'''
+Runs fn once per shard and returns [(shard, result), ...] in shard order.
+Each shard gets its own thread, app context and session, so the queries
+run in parallel.
+'''
+
+
+def scatter_gather(fn, *args, **kwargs):
+    shards = shard_names()
+    if len(shards) == 1:
+        with use_shard(shards[0]):
+            return [(shards[0], fn(*args, **kwargs))]
+
+    app = current_app._get_current_object()
+
+    def gather(shard):
+        with app.app_context():
+            g.shard = shard
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                app.extensions['sqlalchemy'].session.remove()
+
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        return list(zip(shards, executor.map(gather, shards)))
+
+
+def create_all_shards():
+    db = current_app.extensions['sqlalchemy']
+    for engine in shard_engines().values():
+        db.metadata.create_all(engine)
+
+
+def drop_all_shards():
+    db = current_app.extensions['sqlalchemy']
+    for engine in shard_engines().values():
+        db.metadata.drop_all(engine)
@@ -0,0 +1,113 @@
+from functools import lru_cache
+from threading import Lock
+
+from sqlalchemy import bindparam, event, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
+
+from project.models import Student, IEP, Enrollment, LessonPlan, Grade, Accommodation, ChangeLog
+
+
+'''
+Pre-built, parameterized statements for the hot queries in views.py.
+They are built once at import with bindparams, so each request skips
+statement construction, and the cache key (memoized on the statement)
+is only generated once. SQLAlchemy's compiled cache then hits on every
+execution.
+'''
+
+
+ENROLLED_STUDENTS = (
+    select(Student.id, Student.first_name, Student.last_name)
+    .join(Enrollment, Enrollment.student_id == Student.id)
+    .where(Enrollment.class_id == bindparam('class_id'))
+    .order_by(Enrollment.id)
+)
+
+IEPS_BY_STUDENT = (
+    select(IEP.student_id, IEP.description, IEP.disability)
+    .where(IEP.student_id.in_(bindparam('student_ids', expanding=True)))
+    .order_by(IEP.id.desc())
+)
+
+GRADES_BY_STUDENT = (
+    select(Grade.student_id, Grade.id, Grade.subject, Grade.grade_type, Grade.date, Grade.grade_value)
+    .where(Grade.student_id.in_(bindparam('student_ids', expanding=True)))
+    .where(Grade.date >= bindparam('start'), Grade.date < bindparam('end'))
+    .order_by(Grade.id)
+)
+
+CLASS_LESSON_PLANS = (
+    select(LessonPlan.id, LessonPlan.name, LessonPlan.date, LessonPlan.overview,
+           LessonPlan.objective, LessonPlan.subject)
+    .where(LessonPlan.class_id == bindparam('class_id'))
+    .order_by(LessonPlan.id)
+)
+
+LESSON_PLAN_ACCOMMODATIONS = (
+    select(Accommodation.id, Accommodation.text, Student.id, Student.first_name, Student.last_name)
+    .join(Student, Student.id == Accommodation.student_id)
+    .where(Accommodation.lesson_plan_id == bindparam('lesson_plan_id'))
+    .order_by(Accommodation.id)
+)
+
+CHANGES_SINCE = (
+    select(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.operation, ChangeLog.data)
+    .where(ChangeLog.class_id == bindparam('class_id'), ChangeLog.seq > bindparam('since'))
+    .order_by(ChangeLog.seq)
+    .limit(bindparam('limit'))
+)
+
+
+# Used by the entity loaders for every get_or_404 style lookup and FK
+# check. Rows of other schools on the same shard don't match.
+@lru_cache(maxsize=None)
+def entities_by_key(model):
+    return (
+        select(model)
+        .where(model.id.in_(bindparam('keys', expanding=True)))
+        .where(model.in_school(bindparam('school_id')))
+        .order_by(model.id)
+    )
+
+### CACHE METRICS ###
+
+
+class StatementCacheStats:
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.uncached = 0
+
+    def record(self, cache_hit):
+        with self._lock:
+            if cache_hit is CACHE_HIT:
+                self.hits += 1
+            elif cache_hit is CACHE_MISS:
+                self.misses += 1
+            else:
+                self.uncached += 1
+
+    def to_json(self):
+        with self._lock:
+            cached = self.hits + self.misses
+            return {
+                "executions": cached + self.uncached,
+                "hits": self.hits,
+                "misses": self.misses,
+                "uncached": self.uncached,
+                "hit_rate": self.hits / cached if cached else None
+            }
+
+
+statement_cache_stats = StatementCacheStats()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_cache_hit(connection, cursor, statement, parameters, context, executemany):
+    statement_cache_stats.record(getattr(context, 'cache_hit', None))
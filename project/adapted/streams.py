@@ -0,0 +1,31 @@
+import io
+
+
+'''
+Write only file object for writers that expect a file (parquet, arrow,
+zipfile) in streamed responses. Whatever was written since the last
+drain() is handed to the response as the next piece, tell() keeps
+counting so the writers can record offsets.
+'''
+
+
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
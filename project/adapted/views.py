@@ -1,10 +1,23 @@
 from enum import Enum
 from datetime import datetime
 
-from flask import Blueprint, jsonify, request, abort
+from flask import Blueprint, Response, jsonify, request, abort, stream_with_context
 
 from project import db
-from project.models import Teacher, Student, IEP, Enrollment, Class, LessonPlan, Grade, Accommodation, GradeType, SubjectType
+from project.adapted.admission import get_admission
+from project.adapted.bulk import BulkUpdateError, bulk_update
+from project.adapted.changes import DEFAULT_LIMIT, MAX_LIMIT, changes_since
+from project.adapted.compression import encode_response
+from project.adapted.events import get_hub
+from project.adapted.export import EXPORT_FORMATS, export_available, stream_grade_export
+from project.adapted.loaders import load, load_or_404
+from project.adapted.read_models import (
+    StudentRow, AccommodationRow, enrolled_students, first_ieps, grades_by_student,
+    lesson_plan_accommodations, class_lesson_plans as read_lesson_plans)
+from project.adapted.reports import REPORT_FORMATS, load_report_cards, report_available, stream_report_cards
+from project.adapted.sharding import current_school_id, current_shard
+from project.adapted.statements import statement_cache_stats
+from project.models import Teacher, Student, IEP, Enrollment, Class, LessonPlan, Grade, Accommodation, GradeType, SubjectType, validate_school_year
 
 index_blueprint=Blueprint('index_page',__name__)
 
@@ -28,26 +41,29 @@ def validate_enum(enum: Enum, enumText):
 def hello_world():
     return jsonify({"hello": "world"})
 
+
+@index_blueprint.route('/metrics/statement_cache')
+def statement_cache_metrics():
+    return jsonify({"statement_cache": statement_cache_stats.to_json()})
+
+
+@index_blueprint.route('/metrics/admission')
+def admission_metrics():
+    return jsonify({"admission": get_admission().to_json()})
+
 @index_blueprint.route('/class/<int:class_id>/students')
 def class_students(class_id):
     # Check if class exists
-    class_: Class = Class.query.get_or_404(class_id)
+    class_: Class = load_or_404(Class, class_id)
 
-    enrolled_students: list[Enrollment] = Enrollment.query.filter_by(
-        class_id=class_id).all()
+    enrolled: list[StudentRow] = enrolled_students(class_id)
+    ieps = first_ieps([student.id for student in enrolled])
     students = []
-    for enrollment in enrolled_students:
-        student = Student.query.filter_by(id=enrollment.student_id).first()
-        iep = IEP.query.filter_by(student_id=enrollment.student_id).first()
-        iep_object = {
-            "description": iep.description,
-            "disability": iep.disability
-        } if iep else None
+    for student in enrolled:
+        iep = ieps.get(student.id)
         students.append({
-            "id": student.id,
-            "first_name": student.first_name,
-            "last_name": student.last_name,
-            "iep": iep_object
+            **student.to_json(),
+            "iep": iep.to_json() if iep else None
         })
 
     response = {
@@ -56,36 +72,22 @@ def class_students(class_id):
             "students": students
         }
     }
-    return jsonify(response)
+    return encode_response(response)
 
 
 @index_blueprint.route('/class/<int:class_id>/grades')
 def class_grades(class_id):
     # Check if class exists
-    class_: Class = Class.query.get_or_404(class_id)
+    class_: Class = load_or_404(Class, class_id)
 
-    enrolled_students: list[Enrollment] = Enrollment.query.filter_by(
-        class_id=class_id).all()
+    enrolled: list[StudentRow] = enrolled_students(class_id)
+    # Only the class's school year, so Postgres prunes the other grade partitions
+    grades = grades_by_student([student.id for student in enrolled], class_.school_year)
     students = []
-    for enrollment in enrolled_students:
-        student: Student = Student.query.filter_by(
-            id=enrollment.student_id).first()
-        grades: list[Grade] = Grade.query.filter_by(
-            student_id=enrollment.student_id).all()
-        student_grades = []
-        for grade in grades:
-            student_grades.append({
-                "id": grade.id,
-                "subject": str(grade.subject),
-                "grade_type": str(grade.grade_type),
-                "date": grade.date,
-                "grade_value": grade.grade_value
-            })
+    for student in enrolled:
         students.append({
-            "id": student.id,
-            "first_name": student.first_name,
-            "last_name": student.last_name,
-            "grades": student_grades
+            **student.to_json(),
+            "grades": grades[student.id]
         })
 
     response = {
@@ -94,63 +96,42 @@ def class_grades(class_id):
             "students": students
         }
     }
-    return jsonify(response)
+    return encode_response(response)
 
 
 @index_blueprint.route('/class/<int:class_id>/lesson_plans')
 def class_lesson_plans(class_id):
     # Check if class exists
-    class_: Class = Class.query.get_or_404(class_id)
-
-    lesson_plan_rows: list[LessonPlan] = LessonPlan.query.filter_by(
-        class_id=class_id).all()
-    lesson_plans = []
-    for lesson_plan in lesson_plan_rows:
-        lesson_plans.append({
-            "id": lesson_plan.id,
-            "name": lesson_plan.name,
-            "date": lesson_plan.date,
-            "overview": lesson_plan.overview,
-            "objective": lesson_plan.objective,
-            "subject": str(lesson_plan.subject)
-        })
+    class_: Class = load_or_404(Class, class_id)
 
     response = {
         "Class": {
             "id": class_id,
-            "lesson_plans": lesson_plans
+            "lesson_plans": [lesson_plan.to_json() for lesson_plan in read_lesson_plans(class_id)]
         }
     }
-    return jsonify(response)
+    return encode_response(response)
 
 
 @index_blueprint.route('/class/<int:class_id>/lesson_plans/<int:lesson_plan_id>/accommodations')
 def class_lesson_plan_accommodations(class_id, lesson_plan_id):
     # Check if class and lesson plan exists
-    class_: Class = Class.query.get_or_404(class_id)
-    lesson_plan: LessonPlan = LessonPlan.query.get_or_404(lesson_plan_id)
+    class_: Class = load_or_404(Class, class_id)
+    lesson_plan: LessonPlan = load_or_404(LessonPlan, lesson_plan_id)
 
     # Lesson plan ID needs to be of class ID
     if lesson_plan.class_id != class_.id:
         abort(404)
 
-    lesson_plan_specific_accommodations: list[Accommodation] = Accommodation.query.filter_by(
-        lesson_plan_id=lesson_plan_id).all()
+    accommodations: list[AccommodationRow] = lesson_plan_accommodations(lesson_plan_id)
+    ieps = first_ieps([accommodation.student.id for accommodation in accommodations])
     student_accommodations = []
-    for accommodation in lesson_plan_specific_accommodations:
-        student: Student = Student.query.filter_by(
-            id=accommodation.student_id).first()
-        iep = IEP.query.filter_by(student_id=accommodation.student_id).first()
-        iep_object = {
-            "description": iep.description,
-            "disability": iep.disability
-        } if iep else None
+    for accommodation in accommodations:
+        iep = ieps.get(accommodation.student.id)
         student_accommodations.append({
-            "id": student.id,
-            "first_name": student.first_name,
-            "last_name": student.last_name,
-            "iep": iep_object,
-            "accommodation": {"text": accommodation.text, "id": accommodation.id}
+            **accommodation.student.to_json(),
+            "iep": iep.to_json() if iep else None,
+            "accommodation": accommodation.to_json()
         })
 
     response = {
@@ -163,7 +144,192 @@ def class_lesson_plan_accommodations(class_id, lesson_plan_id):
 
         }
     }
-    return jsonify(response)
+    return encode_response(response)
+
+'''
+Clients pass the cursor from their last response as `since` and only get
+what changed after it
+'''
+
+
+@index_blueprint.route('/class/<int:class_id>/changes')
+def class_changes(class_id):
+    # Check if class exists
+    class_: Class = load_or_404(Class, class_id)
+
+    since = request.args.get('since', 0, type=int)
+    limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+    if limit < 1 or limit > MAX_LIMIT:
+        return {'error': f'Invalid limit. Please use a number between 1 and {MAX_LIMIT}'}, 400
+
+    changes, has_more = changes_since(class_id, since, limit)
+    response = {
+        "Class": {
+            "id": class_id,
+            "changes": changes,
+            "cursor": changes[-1]["seq"] if changes else since,
+            "has_more": has_more
+        }
+    }
+    return encode_response(response)
+
+'''
+Live updates for teachers co-editing a class. Reconnecting clients send
+Last-Event-ID (or since) and get the changes they missed replayed first.
+'''
+
+
+@index_blueprint.route('/class/<int:class_id>/events')
+def class_events(class_id):
+    # Check if class exists
+    class_: Class = load_or_404(Class, class_id)
+
+    since = request.headers.get('Last-Event-ID', type=int) or request.args.get('since', type=int)
+
+    hub = get_hub()
+    subscriber = hub.subscribe(class_id, current_shard())
+    if subscriber is None:
+        return {'error': 'Too many open event streams'}, 503, {'Retry-After': '30'}
+
+    # Subscribed before reading the replay so nothing falls in between
+    try:
+        replay, has_more = changes_since(class_id, since, MAX_LIMIT) if since is not None else ([], False)
+    except Exception:
+        hub.unsubscribe(subscriber)
+        raise
+    # The stream can stay open for hours, don't hold on to a connection
+    db.session.remove()
+
+    response = Response(hub.stream(subscriber, replay, resync=has_more), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+### ANALYTICS ###
+
+
+@index_blueprint.route('/class/<int:class_id>/analytics')
+def class_grade_analytics(class_id):
+    # NumPy is only imported once analytics are first requested
+    from project.adapted.analytics import DEFAULT_ROLLING_WINDOW, class_analytics
+
+    # Check if class exists
+    class_: Class = load_or_404(Class, class_id)
+
+    window = request.args.get('window', DEFAULT_ROLLING_WINDOW, type=int)
+    if window < 1:
+        return {'error': 'Invalid window. Please use a positive integer'}, 400
+
+    response = {
+        "Class": class_analytics(class_.id, class_.school_year, window)
+    }
+    return encode_response(response)
+
+
+@index_blueprint.route('/analytics/<school_year>')
+def school_grade_analytics(school_year):
+    from project.adapted.analytics import school_analytics
+
+    try:
+        validate_school_year(school_year)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    response = {
+        "School": school_analytics(school_year, current_school_id())['payload']
+    }
+    return encode_response(response)
+
+
+'''
+District wide statistics for admins, gathered from every school on every
+shard
+'''
+
+
+@index_blueprint.route('/admin/analytics/<school_year>')
+def district_grade_analytics(school_year):
+    from project.adapted.analytics import school_analytics
+
+    try:
+        validate_school_year(school_year)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    response = {
+        "District": school_analytics(school_year)['payload']
+    }
+    return encode_response(response)
+
+### EXPORTS ###
+
+
+'''
+District analysts download every grade for a school year as Parquet or Arrow
+'''
+
+
+@index_blueprint.route('/export/grades/<school_year>')
+def export_grades(school_year):
+    try:
+        validate_school_year(school_year)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+
+    fmt = request.args.get('format', 'parquet')
+    if fmt not in EXPORT_FORMATS:
+        return {'error': f'Invalid format. Please use one of: {", ".join(EXPORT_FORMATS)}'}, 400
+
+    if not export_available():
+        return {'error': 'Gradebook exports are not available on this server'}, 501
+
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    response = Response(stream_with_context(
+        stream_grade_export(school_year, fmt)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=grades_{school_year}.{extension}'
+    return response
+
+### REPORT CARDS ###
+
+
+def report_cards_response(school_year, class_id=None):
+    fmt = request.args.get('format', 'html')
+    if fmt not in REPORT_FORMATS:
+        return {'error': f'Invalid format. Please use one of: {", ".join(REPORT_FORMATS)}'}, 400
+
+    if not report_available(fmt):
+        return {'error': f'{fmt} report cards are not available on this server'}, 501
+
+    cards = load_report_cards(school_year, class_id, current_school_id())
+    # Everything is loaded, rendering can take a while without a connection
+    db.session.remove()
+
+    suffix = f'_class_{class_id}' if class_id is not None else ''
+    response = Response(stream_with_context(stream_report_cards(cards, fmt)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=report_cards_{school_year}{suffix}.zip'
+    response.headers['X-Report-Count'] = str(len(cards))
+    return response
+
+
+'''
+End of term report cards, one document per student in a zip archive
+'''
+
+
+@index_blueprint.route('/class/<int:class_id>/report_cards')
+def class_report_cards(class_id):
+    # Check if class exists
+    class_: Class = load_or_404(Class, class_id)
+    return report_cards_response(class_.school_year, class_.id)
+
+
+@index_blueprint.route('/report_cards/<school_year>')
+def school_report_cards(school_year):
+    try:
+        validate_school_year(school_year)
+    except ValueError as e:
+        return {'error': str(e)}, 400
+    return report_cards_response(school_year)
 
 ### POST REQUESTS ###
 
@@ -180,7 +346,8 @@ def add_class():
     if not is_valid:
         return error, 400
 
-    if not Teacher.query.filter_by(id=request.json['teacher_id']).first():
+    teacher: Teacher = load(Teacher, request.json['teacher_id'])
+    if not teacher:
         return {'error': 'Invalid teacher ID'}, 400
 
     # TODO: Will need to add some sort of error checking for school year.
@@ -188,6 +355,8 @@ def add_class():
     # that error to be handled gracefully.
 
     new_class = Class(
+        # Classes belong to their teacher's school
+        school_id=teacher.school_id,
         teacher_id=request.json['teacher_id'],
         name=request.json['name'],
         school_year=request.json['school_year']
@@ -210,6 +379,7 @@ def add_student():
         return error, 400
 
     new_student = Student(
+        school_id=current_school_id(),
         first_name=request.json['first_name'],
         last_name=request.json['last_name']
     )
@@ -232,6 +402,7 @@ def add_teacher():
         return error, 400
 
     new_teacher = Teacher(
+        school_id=current_school_id(),
         first_name=request.json['first_name'],
         last_name=request.json['last_name'],
         email=request.json['email'],
@@ -255,7 +426,7 @@ def add_IEP():
     if not is_valid:
         return error, 400
 
-    if not Student.query.filter_by(id=request.json['student_id']).first():
+    if not load(Student, request.json['student_id']):
         return {'error': 'Invalid student ID'}, 400
 
     try:
@@ -286,10 +457,10 @@ def add_enrollment():
     if not is_valid:
         return error, 400
 
-    if not Class.query.filter_by(id=request.json['class_id']).first():
+    if not load(Class, request.json['class_id']):
         return {'error': 'Invalid class ID'}, 400
 
-    if not Student.query.filter_by(id=request.json['student_id']).first():
+    if not load(Student, request.json['student_id']):
         return {'error': 'Invalid student ID'}, 400
 
     new_enrollment = Enrollment(
@@ -318,7 +489,7 @@ def add_lesson_plan():
     if not is_valid:
         return error, 400
 
-    if not Class.query.filter_by(id=request.json['class_id']).first():
+    if not load(Class, request.json['class_id']):
         return {'error': 'Invalid class ID'}, 400
 
     try:
@@ -360,7 +531,7 @@ def add_grade():
     if not is_valid:
         return error, 400
 
-    if not Student.query.filter_by(id=request.json['student_id']).first():
+    if not load(Student, request.json['student_id']):
         return {'error': 'Invalid student ID'}, 400
 
     try:
@@ -400,10 +571,10 @@ def add_accommodation():
     if not is_valid:
         return error, 400
 
-    if not Student.query.filter_by(id=request.json['student_id']).first():
+    if not load(Student, request.json['student_id']):
         return {'error': 'Invalid student ID'}, 400
 
-    if not LessonPlan.query.filter_by(id=request.json['lesson_plan_id']).first():
+    if not load(LessonPlan, request.json['lesson_plan_id']):
         return {'error': 'Invalid lesson plan ID'}, 400
 
     new_accommodation = Accommodation(
@@ -426,9 +597,9 @@ Admins can update classes
 
 @index_blueprint.route('/class/<int:id>', methods=['PUT'])
 def update_class(id):
-    class_ = Class.query.get_or_404(id)
+    class_ = load_or_404(Class, id)
 
-    if request.json.get('teacher_id') and not Teacher.query.filter_by(id=request.json['teacher_id']).first():
+    if request.json.get('teacher_id') and not load(Teacher, request.json['teacher_id']):
         return {'error': 'Invalid teacher ID'}, 400
 
     # TODO: Will need to add some sort of error checking for school year.
@@ -450,7 +621,7 @@ Admins can update students
 
 @index_blueprint.route('/student/<int:id>', methods=['PUT'])
 def update_student(id):
-    student = Student.query.get_or_404(id)
+    student = load_or_404(Student, id)
 
     student.first_name = request.json.get('first_name') or student.first_name
     student.last_name = request.json.get('last_name') or student.last_name
@@ -466,7 +637,7 @@ Admins can update teachers
 
 @index_blueprint.route('/teacher/<int:id>', methods=['PUT'])
 def update_teacher(id):
-    teacher = Teacher.query.get_or_404(id)
+    teacher = load_or_404(Teacher, id)
 
     teacher.first_name = request.json.get('first_name') or teacher.first_name
     teacher.last_name = request.json.get('last_name') or teacher.last_name
@@ -484,9 +655,9 @@ Resource teachers can update IEPs
 
 @index_blueprint.route('/IEP/<int:id>', methods=['PUT'])
 def update_IEP(id):
-    iep = IEP.query.get_or_404(id)
+    iep = load_or_404(IEP, id)
 
-    if request.json.get('student_id') and not Student.query.filter_by(id=request.json['student_id']).first():
+    if request.json.get('student_id') and not load(Student, request.json['student_id']):
         return {'error': 'Invalid student ID'}, 400
 
     if request.json.get('start_date'):
@@ -511,12 +682,12 @@ Admins can update student enrollment (maybe teachers)
 
 @index_blueprint.route('/enrollment/<int:id>', methods=['PUT'])
 def update_enrollment(id):
-    enrollment = Enrollment.query.get_or_404(id)
+    enrollment = load_or_404(Enrollment, id)
 
-    if request.json.get('student_id') and not Student.query.filter_by(id=request.json['student_id']).first():
+    if request.json.get('student_id') and not load(Student, request.json['student_id']):
         return {'error': 'Invalid student ID'}, 400
 
-    if request.json.get('class_id') and not Class.query.filter_by(id=request.json['class_id']).first():
+    if request.json.get('class_id') and not load(Class, request.json['class_id']):
         return {'error': 'Invalid class ID'}, 400
 
     enrollment.student_id = request.json.get(
@@ -534,9 +705,9 @@ Teachers update lesson plans
 
 @index_blueprint.route('/lesson_plan/<int:id>', methods=['PUT'])
 def update_lesson_plan(id):
-    lesson_plan = LessonPlan.query.get_or_404(id)
+    lesson_plan = load_or_404(LessonPlan, id)
 
-    if request.json.get('class_id') and not Class.query.filter_by(id=request.json['class_id']).first():
+    if request.json.get('class_id') and not load(Class, request.json['class_id']):
         return {'error': 'Invalid class ID'}, 400
 
     if request.json.get('date'):
@@ -569,9 +740,9 @@ Teachers update grades
 
 @index_blueprint.route('/grade/<int:id>', methods=['PUT'])
 def update_grade(id):
-    grade = Grade.query.get_or_404(id)
+    grade = load_or_404(Grade, id)
 
-    if request.json.get('student_id') and not Student.query.filter_by(id=request.json['student_id']).first():
+    if request.json.get('student_id') and not load(Student, request.json['student_id']):
         return {'error': 'Invalid student ID'}, 400
 
     if request.json.get('date'):
@@ -610,12 +781,12 @@ Teacher can modify accommodations manually
 
 @index_blueprint.route('/accommodation/<int:id>', methods=['PUT'])
 def update_accommodation(id):
-    accommodation = Accommodation.query.get_or_404(id)
+    accommodation = load_or_404(Accommodation, id)
 
-    if request.json.get('student_id') and not Student.query.filter_by(id=request.json['student_id']).first():
+    if request.json.get('student_id') and not load(Student, request.json['student_id']):
         return {'error': 'Invalid student ID'}, 400
 
-    if request.json.get('lesson_plan_id') and not LessonPlan.query.filter_by(id=request.json['lesson_plan_id']).first():
+    if request.json.get('lesson_plan_id') and not load(LessonPlan, request.json['lesson_plan_id']):
         return {'error': 'Invalid lesson plan ID'}, 400
 
     accommodation.student_id = request.json.get(
@@ -627,6 +798,28 @@ def update_accommodation(id):
     db.session.commit()
     return {'message': 'Successfully updated <Accommodation>'}, 204
 
+### BULK REQUESTS ###
+
+
+'''
+Teachers and admins update many rows at once, e.g. curving a quiz:
+{"filter": {"class_id": 1, "grade_type": "Quiz", "date": "2022-10-03"},
+ "patch": {"grade_value": {"add": 5}}}
+'''
+
+
+@index_blueprint.route('/bulk/<entity>', methods=['PUT'])
+def update_bulk(entity):
+    is_valid, error = validate_request(request, ['filter', 'patch'])
+    if not is_valid:
+        return error, 400
+
+    try:
+        count = bulk_update(entity, request.json['filter'], request.json['patch'])
+    except BulkUpdateError as e:
+        return {'error': str(e)}, 400
+    return {'message': f'Successfully updated {count} <{entity}>', 'count': count}, 200
+
 ### DELETE REQUESTS ###
 
 
@@ -637,7 +830,7 @@ Admins can delete classes
 
 @index_blueprint.route('/class/<int:id>', methods=['DELETE'])
 def delete_class(id):
-    class_ = Class.query.get_or_404(id)
+    class_ = load_or_404(Class, id)
     db.session.delete(class_)
     db.session.commit()
     return {'message': 'Successfully deleted <Class>'}, 204
@@ -650,7 +843,7 @@ Admins can delete students
 
 @index_blueprint.route('/student/<int:id>', methods=['DELETE'])
 def delete_student(id):
-    student = Student.query.get_or_404(id)
+    student = load_or_404(Student, id)
     db.session.delete(student)
     db.session.commit()
     return {'message': 'Successfully deleted <Student>'}, 204
@@ -663,7 +856,7 @@ Admins can delete teachers
 
 @index_blueprint.route('/teacher/<int:id>', methods=['DELETE'])
 def delete_teacher(id):
-    teacher = Teacher.query.get_or_404(id)
+    teacher = load_or_404(Teacher, id)
     db.session.delete(teacher)
     db.session.commit()
     return {'message': 'Successfully deleted <Teacher>'}, 204
@@ -676,7 +869,7 @@ Resource teachers can delete IEPs
 
 @index_blueprint.route('/IEP/<int:id>', methods=['DELETE'])
 def delete_IEP(id):
-    iep = IEP.query.get_or_404(id)
+    iep = load_or_404(IEP, id)
     db.session.delete(iep)
     db.session.commit()
     return {'message': 'Successfully deleted <IEP>'}, 204
@@ -689,7 +882,7 @@ Admins can delete student enrollment (maybe teachers)
 
 @index_blueprint.route('/enrollment/<int:id>', methods=['DELETE'])
 def delete_enrollment(id):
-    enrollment = Enrollment.query.get_or_404(id)
+    enrollment = load_or_404(Enrollment, id)
     db.session.delete(enrollment)
     db.session.commit()
     return {'message': 'Successfully deleted <Enrollment>'}, 204
@@ -702,7 +895,7 @@ Teachers can delete lesson plans
 
 @index_blueprint.route('/lesson_plan/<int:id>', methods=['DELETE'])
 def delete_lesson_plan(id):
-    lesson_plan = LessonPlan.query.get_or_404(id)
+    lesson_plan = load_or_404(LessonPlan, id)
     db.session.delete(lesson_plan)
     db.session.commit()
     return {'message': 'Successfully deleted <LessonPlan>'}, 204
@@ -715,7 +908,7 @@ Teachers can delete grades
 
 @index_blueprint.route('/grade/<int:id>', methods=['DELETE'])
 def delete_grade(id):
-    grade = Grade.query.get_or_404(id)
+    grade = load_or_404(Grade, id)
     db.session.delete(grade)
     db.session.commit()
     return {'message': 'Successfully deleted <Grade>'}, 204
@@ -728,7 +921,7 @@ Teacher can delete accommodations manually
 
 @index_blueprint.route('/accommodation/<int:id>', methods=['DELETE'])
 def delete_accommodation(id):
-    accommodation = Accommodation.query.get_or_404(id)
+    accommodation = load_or_404(Accommodation, id)
     db.session.delete(accommodation)
     db.session.commit()
     return {'message': 'Successfully deleted <Accommodation>'}, 204
\ No newline at end of file
@@ -2,3 +2,11 @@ import os
 
 def get_connect_url():
     return os.environ.get("AWS_DATABASE_URL")
+
+# Extra shards as whitespace separated name=url pairs
+def get_shard_urls():
+    shards = {}
+    for entry in os.environ.get("AWS_SHARD_DATABASE_URLS", "").split():
+        name, _, url = entry.partition("=")
+        shards[name] = url
+    return shards
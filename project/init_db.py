@@ -1,13 +1,29 @@
 from datetime import datetime
 from random import randrange
 
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, literal, text
+
+from project import db
+from project.adapted.partitions import (
+    create_partition, create_upcoming_partitions, is_partitioned, is_unpartitioned_postgres)
+from project.adapted.sharding import DEFAULT_SHARD, create_all_shards, drop_all_shards, set_shard, shard_engines
 from project.models import Teacher, Grade, LessonPlan, Class, Student, GradeType, SubjectType, IEP, Accommodation, Enrollment
 
+SAMPLE_SCHOOL_YEAR = '2022-2023'
+
 # Only called to initialize/reset the db. Remove later
 def init_db(db, app):
     with app.app_context():
-        db.drop_all()
-        db.create_all()
+        drop_all_shards()
+        create_all_shards()
+        # The sample data is all school 1, which lives on the default shard
+        set_shard(DEFAULT_SHARD)
+        connection = db.session.connection()
+        if is_partitioned(connection):
+            create_partition(connection, SAMPLE_SCHOOL_YEAR)
 
         # create 2 teachers
         teacher1 = Teacher(first_name='John', last_name='Doe',
@@ -34,8 +50,8 @@ def init_db(db, app):
 
         # create 2 classes and enroll 5 students in each class
         class1 = Class(name='English 101',
-                    school_year='2022-2023', teacher=teacher1)
-        class2 = Class(name='Math 101', school_year='2022-2023', teacher=teacher2)
+                    school_year=SAMPLE_SCHOOL_YEAR, teacher=teacher1)
+        class2 = Class(name='Math 101', school_year=SAMPLE_SCHOOL_YEAR, teacher=teacher2)
         db.session.add_all([class1, class2])
         db.session.commit()
 
@@ -111,4 +127,70 @@ def init_db(db, app):
         acc5 = Accommodation(student_id=student10.id, lesson_plan_id=lesson4.id,
                             text='Provide alternative seating options')
         db.session.add_all([acc1, acc2, acc3, acc4, acc5])
-        db.session.commit()
\ No newline at end of file
+        db.session.commit()
+
+
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    '''Drop, recreate and seed every table.'''
+    init_db(db, current_app)
+    click.echo('Initialized the database')
+
+
+'''
+Adds model columns the tables don't have yet, e.g. after upgrading a
+database created by an older release. Existing rows get the column's
+default, NOT NULL columns without a plain default can't be added.
+'''
+
+
+def add_missing_columns(connection):
+    dialect = connection.dialect
+    preparer = dialect.identifier_preparer
+    inspector = inspect(connection)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        new_columns = [column for column in table.columns if column.name not in existing]
+        for column in new_columns:
+            ddl = f'{preparer.format_column(column)} {column.type.compile(dialect=dialect)}'
+            if column.default is not None and column.default.is_scalar:
+                value = literal(column.default.arg, column.type).compile(
+                    dialect=dialect, compile_kwargs={'literal_binds': True})
+                ddl += f' DEFAULT {value}'
+            elif not column.nullable:
+                raise click.ClickException(f'Cannot add {table.name}.{column.name}, it is NOT NULL without a default')
+            if not column.nullable:
+                ddl += ' NOT NULL'
+            connection.execute(text(f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}'))
+            added.append(f'{table.name}.{column.name}')
+
+        new_names = {column.name for column in new_columns}
+        for index in table.indexes:
+            if new_names.intersection(column.name for column in index.columns):
+                index.create(connection, checkfirst=True)
+    return added
+
+
+@click.command('create-db')
+@with_appcontext
+def create_db_command():
+    '''Create missing tables and columns on every shard, keeping existing data.
+
+    Safe to run on every deploy (see .ebextensions/db.config).
+    '''
+    create_all_shards()
+    for shard, engine in shard_engines().items():
+        with engine.begin() as connection:
+            added = add_missing_columns(connection)
+            partitions = create_upcoming_partitions(connection)
+            unpartitioned = is_unpartitioned_postgres(connection)
+        added += [f'partition {name}' + (f' ({moved} grades moved)' if moved else '') for name, moved in partitions]
+        click.echo(f'Shard {shard}: ' + (f'added {", ".join(added)}' if added else 'schema is up to date'))
+        if unpartitioned:
+            # Grades still work, but reads scan every school year
+            click.echo(f'Warning: grade on shard {shard} was created before partitioning and is not '
+                       f'partitioned, it needs a manual migration. Until then archive with --output-dir.', err=True)
@@ -1,9 +1,11 @@
 from enum import Enum
+from datetime import date
 import re
 
 from sqlalchemy.orm import validates
 
 from project import db
+from project.adapted.sharding import DEFAULT_SCHOOL_ID
 
 
 class GradeType(Enum):
@@ -21,25 +23,56 @@ class SubjectType(Enum):
     READING_AND_WRITING = 'Reading & Writing'
     MATH = 'Math'
 
+SCHOOL_YEAR_PATTERN = re.compile(r'^\d{4}-\d{4}$')
+
+# Use regex to validate school years
+def validate_school_year(value):
+    if not SCHOOL_YEAR_PATTERN.match(value):
+        raise ValueError('Invalid school year format. Please use the format: YYYY-YYYY')
+    start_year, end_year = value.split('-')
+    if int(start_year) < 1900 or int(end_year) > 2100:
+        raise ValueError('Invalid school year. Please enter a year between 1900 and 2100.')
+    if int(end_year) - int(start_year) != 1:
+        raise ValueError('Invalid school year. Please enter consecutive years.')
+    return value
+
+# School years run from August 1st to July 31st
+def school_year_bounds(school_year):
+    start_year, end_year = school_year.split('-')
+    return date(int(start_year), 8, 1), date(int(end_year), 8, 1)
+
 class Teacher(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # Tenant key, decides which shard the row lives on (see project/adapted/sharding.py)
+    school_id = db.Column(db.Integer, nullable=False, default=DEFAULT_SCHOOL_ID, index=True)
     first_name = db.Column(db.String(50))
     last_name = db.Column(db.String(50))
     email = db.Column(db.String(120), unique=True)
     password = db.Column(db.String(120))
     classes = db.relationship('Class', backref='teacher', lazy=True)
     
+    # Filter for rows belonging to school_id, a shard can hold several schools
+    @classmethod
+    def in_school(cls, school_id):
+        return cls.school_id == school_id
+
     def __repr__(self):
         return f'<Teacher {self.first_name} {self.last_name}>'
 
 class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # Tenant key, decides which shard the row lives on (see project/adapted/sharding.py)
+    school_id = db.Column(db.Integer, nullable=False, default=DEFAULT_SCHOOL_ID, index=True)
     first_name = db.Column(db.String(50))
     last_name = db.Column(db.String(50))
     ieps = db.relationship('IEP', cascade='delete')
     grades = db.relationship('Grade', cascade='delete')
     accommodations = db.relationship('Accommodation', cascade='delete')
 
+    @classmethod
+    def in_school(cls, school_id):
+        return cls.school_id == school_id
+
     def __repr__(self):
         return f'<Student {self.first_name} {self.last_name}>'
 
@@ -50,6 +83,11 @@ class IEP(db.Model):
     disability = db.Column(db.String(120))
     start_date = db.Column(db.Date)
 
+    # Rows belong to the school of their student
+    @classmethod
+    def in_school(cls, school_id):
+        return cls.student_id.in_(db.select(Student.id).where(Student.in_school(school_id)))
+
     def __repr__(self):
         return f'<IEP for student ID: {self.student_id} with {self.disability}>'
 
@@ -58,32 +96,41 @@ class Enrollment(db.Model):
     student_id = db.Column('student_id', db.Integer, db.ForeignKey('student.id'))
     class_id = db.Column('class_id', db.Integer, db.ForeignKey('class.id'))
 
+    # Rows belong to the school of their class
+    @classmethod
+    def in_school(cls, school_id):
+        return cls.class_id.in_(db.select(Class.id).where(Class.in_school(school_id)))
+
     def __repr__(self):
         return f'<Enrollment for student ID: {self.student_id} in class ID: {self.class_id}>'
 
 class Class(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    # Tenant key, decides which shard the row lives on (see project/adapted/sharding.py)
+    school_id = db.Column(db.Integer, nullable=False, default=DEFAULT_SCHOOL_ID, index=True)
     teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'))
     name = db.Column(db.String(50))
     school_year = db.Column(db.String(9)) # YYYY-YYYY
     lesson_plans = db.relationship('LessonPlan', cascade='delete')
 
-    # Use regex to validate the school_year field
     @validates('school_year')
     def validate_school_year(self, key, value):
-        if not re.match(r'^\d{4}-\d{4}$', value):
-            raise ValueError('Invalid school year format. Please use the format: YYYY-YYYY')
-        start_year, end_year = value.split('-')
-        if int(start_year) < 1900 or int(end_year) > 2100:
-            raise ValueError('Invalid school year. Please enter a year between 1900 and 2100.')
-        if int(end_year) - int(start_year) != 1:
-            raise ValueError('Invalid school year. Please enter consecutive years.')
-        return value
+        return validate_school_year(value)
+
+    @classmethod
+    def in_school(cls, school_id):
+        return cls.school_id == school_id
 
     def __repr__(self):
         return f'<Class {self.name} {self.school_year}>'
 
 class LessonPlan(db.Model):
+    # Not partitioned since accommodations reference lesson_plan.id, and
+    # Postgres needs the partition key in every unique key an FK points at
+    __table_args__ = (
+        db.Index('ix_lesson_plan_class_id_date', 'class_id', 'date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     class_id = db.Column(db.Integer, db.ForeignKey('class.id'))
     name = db.Column(db.String(50))
@@ -93,17 +140,39 @@ class LessonPlan(db.Model):
     subject = db.Column(db.Enum(SubjectType))
     accommodations = db.relationship('Accommodation', cascade='delete')
 
+    # Rows belong to the school of their class
+    @classmethod
+    def in_school(cls, school_id):
+        return cls.class_id.in_(db.select(Class.id).where(Class.in_school(school_id)))
+
     def __repr__(self):
         return f'<Lesson Plan {self.name} {self.date}>'
 
 class Grade(db.Model):
+    # Range partitioned by date on Postgres (see project/adapted/partitions.py),
+    # reads bounded with in_school_year only scan that year's partition
+    __table_args__ = (
+        db.Index('ix_grade_student_id_date', 'student_id', 'date'),
+        {'postgresql_partition_by': 'RANGE (date)', 'info': {'partition_key': 'date'}}
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('student.id'))
     grade_type = db.Column(db.Enum(GradeType))
     grade_value = db.Column(db.Float)
-    date = db.Column(db.Date)
+    date = db.Column(db.Date, nullable=False)
     subject = db.Column(db.Enum(SubjectType))
 
+    @classmethod
+    def in_school_year(cls, school_year):
+        start, end = school_year_bounds(school_year)
+        return cls.date >= start, cls.date < end
+
+    # Rows belong to the school of their student
+    @classmethod
+    def in_school(cls, school_id):
+        return cls.student_id.in_(db.select(Student.id).where(Student.in_school(school_id)))
+
     def __repr__(self):
         return f'<Grade {self.id} {self.date}>'
 
@@ -113,5 +182,32 @@ class Accommodation(db.Model):
     lesson_plan_id = db.Column(db.Integer, db.ForeignKey('lesson_plan.id'))
     text = db.Column(db.Text)
 
+    # Rows belong to the school of their student
+    @classmethod
+    def in_school(cls, school_id):
+        return cls.student_id.in_(db.select(Student.id).where(Student.in_school(school_id)))
+
+    def __repr__(self):
+        return f'<Accommodation for student ID: {self.student_id}>'
+
+class ChangeLog(db.Model):
+    # seq is handed to clients as their sync cursor. It counts per class
+    # (see ChangeLogCursor), so a class's rows commit in seq order.
+    class_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    seq = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    entity = db.Column(db.String(30))
+    entity_id = db.Column(db.Integer)
+    operation = db.Column(db.String(6))
+    data = db.Column(db.JSON)
+
+    def __repr__(self):
+        return f'<ChangeLog {self.class_id}/{self.seq} {self.operation} {self.entity} {self.entity_id}>'
+
+class ChangeLogCursor(db.Model):
+    # Last seq handed out for each class. Writers bump it with an upsert,
+    # which keeps the row locked until they commit.
+    class_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    seq = db.Column(db.BigInteger, nullable=False)
+
     def __repr__(self):
-        return f'<Accommodation for student ID: {self.student_id}>'
\ No newline at end of file
+        return f'<ChangeLogCursor {self.class_id} {self.seq}>'
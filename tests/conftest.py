@@ -0,0 +1,71 @@
+from datetime import date
+
+import pytest
+
+from project import create_app, db
+from project.adapted.analytics_cache import analytics_cache
+from project.adapted.sharding import create_all_shards, use_shard
+from project.models import Teacher, Student, Enrollment, Class, Grade, GradeType, SubjectType
+
+# School 1 has the default shard to itself, schools 2 and 3 share shard_1
+SCHOOLS = (1, 2, 3)
+STUDENTS = 3
+
+
+'''
+Every school gets a teacher, a 2022-2023 class and STUDENTS enrolled
+students with one quiz each. Grade values are 10 * school id, so an
+average shows which schools went into it.
+'''
+
+
+@pytest.fixture
+def app(tmp_path):
+    application = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "default.db"}',
+        'SHARDS': {'shard_1': f'sqlite:///{tmp_path / "shard_1.db"}'},
+        'SHARD_SCHOOLS': {2: 'shard_1', 3: 'shard_1'},
+        'ADMISSION_ENABLED': False,
+        'EVENTS_BACKEND': 'memory',
+    })
+    with application.app_context():
+        create_all_shards()
+    # Per process, keys would otherwise carry over from the previous test's databases
+    analytics_cache.clear()
+    yield application
+    with application.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def schools(app):
+    router = app.extensions['sharding']
+    seeded = {}
+    with app.app_context():
+        for school_id in SCHOOLS:
+            with use_shard(router.shard_for_school(school_id)):
+                teacher = Teacher(first_name='Test', last_name=f'School{school_id}', school_id=school_id,
+                                  email=f'test{school_id}@example.com', password='password')
+                class_ = Class(name=f'Class {school_id}', school_year='2022-2023', teacher=teacher,
+                               school_id=school_id)
+                students = [Student(first_name=f'First{i}', last_name=f'School{school_id}', school_id=school_id)
+                            for i in range(STUDENTS)]
+                db.session.add_all([teacher, class_] + students)
+                db.session.flush()
+                db.session.add_all([Enrollment(student_id=student.id, class_id=class_.id) for student in students])
+                db.session.add_all([
+                    Grade(student_id=student.id, grade_type=GradeType.QUIZ, subject=SubjectType.MATH,
+                          date=date(2022, 10, 3), grade_value=10 * school_id)
+                    for student in students])
+                db.session.commit()
+                seeded[school_id] = {'teacher_id': teacher.id, 'class_id': class_.id,
+                                     'student_ids': [student.id for student in students]}
+        db.session.remove()
+    return seeded
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
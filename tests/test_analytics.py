@@ -0,0 +1,30 @@
+from project.adapted.sharding import SCHOOL_HEADER
+
+
+def test_school_analytics_only_count_the_school(client, schools):
+    for school_id in (1, 2, 3):
+        response = client.get('/analytics/2022-2023', headers={SCHOOL_HEADER: str(school_id)})
+        assert response.status_code == 200
+        payload = response.json['School']
+        assert payload['school_id'] == school_id
+        assert payload['student_count'] == len(schools[school_id]['student_ids'])
+        assert payload['subjects']['Math']['min'] == payload['subjects']['Math']['max'] == 10 * school_id
+
+
+def test_school_analytics_are_cached_per_school(client, schools):
+    means = [client.get('/analytics/2022-2023', headers={SCHOOL_HEADER: str(school_id)}).json['School']['mean']
+             for school_id in (2, 3, 2)]
+    assert means == [20, 30, 20]
+
+
+def test_class_percentiles_rank_against_own_school(client, schools):
+    # School 2's students score lower on the same shard, they don't push school 3's ranks up
+    response = client.get(f'/class/{schools[3]["class_id"]}/analytics', headers={SCHOOL_HEADER: '3'})
+    assert {student['school_percentile_rank'] for student in response.json['Class']['students']} == {50.0}
+
+
+def test_district_analytics_gather_every_school(client, schools):
+    payload = client.get('/admin/analytics/2022-2023').json['District']
+    assert payload['school_id'] is None
+    assert payload['student_count'] == sum(len(school['student_ids']) for school in schools.values())
+    assert payload['subjects']['Math']['histogram']['counts'][1:4] == [3, 3, 3]
@@ -0,0 +1,66 @@
+from sqlalchemy import select
+
+from project import db
+from project.adapted.sharding import SCHOOL_HEADER, use_shard
+from project.models import Student, Enrollment, Grade
+
+
+def grades_of(app, school_id):
+    with app.app_context(), use_shard(app.extensions['sharding'].shard_for_school(school_id)):
+        return dict(db.session.execute(
+            select(Grade.id, Grade.grade_value).join(Student, Student.id == Grade.student_id)
+            .where(Student.school_id == school_id)).all())
+
+
+def bulk(client, entity, school_id, filters, patch):
+    return client.put(f'/bulk/{entity}', json={'filter': filters, 'patch': patch},
+                      headers={SCHOOL_HEADER: str(school_id)})
+
+
+def test_bulk_update_by_id_skips_other_schools_on_the_shard(app, client, schools):
+    other = grades_of(app, 2)
+    response = bulk(client, 'grade', 3, {'id': list(other)}, {'grade_value': {'add': 5}})
+    assert response.status_code == 200
+    assert response.json['count'] == 0
+    assert grades_of(app, 2) == other
+
+
+def test_bulk_update_only_changes_own_school(app, client, schools):
+    other = grades_of(app, 2)
+    ids = list(grades_of(app, 3)) + list(other)
+    response = bulk(client, 'grade', 3, {'id': ids}, {'grade_value': {'add': 5}})
+    assert response.json['count'] == len(schools[3]['student_ids'])
+    assert set(grades_of(app, 3).values()) == {35}
+    assert grades_of(app, 2) == other
+
+
+def test_bulk_update_rejects_another_schools_student(app, client, schools):
+    response = bulk(client, 'grade', 3, {'student_id': schools[2]['student_ids'][0]}, {'grade_value': 0})
+    assert response.status_code == 400
+    assert response.json['error'] == 'Invalid student ID'
+
+    response = bulk(client, 'grade', 3, {'student_id': schools[3]['student_ids'] + schools[2]['student_ids']},
+                    {'grade_value': 0})
+    assert response.status_code == 400
+    assert set(grades_of(app, 2).values()) == {20}
+
+
+def test_bulk_update_rejects_another_schools_class(app, client, schools):
+    patches = {'grade': {'grade_value': 0}, 'enrollment': {'class_id': schools[3]['class_id']},
+               'lesson_plan': {'class_id': schools[3]['class_id']}}
+    for entity, patch in patches.items():
+        response = bulk(client, entity, 3, {'class_id': schools[2]['class_id']}, patch)
+        assert response.status_code == 400, entity
+        assert response.json['error'] == 'Invalid class ID'
+
+    with app.app_context(), use_shard('shard_1'):
+        enrolled = db.session.scalars(
+            select(Enrollment.student_id).where(Enrollment.class_id == schools[2]['class_id'])).all()
+    assert sorted(enrolled) == sorted(schools[2]['student_ids'])
+
+
+def test_bulk_update_requires_an_anchor(app, client, schools):
+    for filters in ({'grade_value': {'gte': 0}}, {'id': {'gte': 0}}):
+        response = bulk(client, 'grade', 1, filters, {'grade_value': 0})
+        assert response.status_code == 400
+    assert set(grades_of(app, 1).values()) == {10}
@@ -0,0 +1,49 @@
+from flask import g
+
+from project import db
+from project.adapted.loaders import load, load_many
+from project.adapted.sharding import SCHOOL_HEADER
+from project.models import Student, Class, Grade
+
+
+def request_for(app, school_id):
+    # Any school scoped endpoint, the router picks the shard in before_request
+    context = app.test_request_context('/class/1/grades', headers={SCHOOL_HEADER: str(school_id)})
+    context.push()
+    app.preprocess_request()
+    assert g.shard == app.extensions['sharding'].shard_for_school(school_id)
+    return context
+
+
+def test_load_misses_rows_of_another_school_on_the_shard(app, schools):
+    context = request_for(app, 3)
+    try:
+        assert load(Student, schools[2]['student_ids'][0]) is None
+        assert load(Class, schools[2]['class_id']) is None
+        assert load(Class, schools[3]['class_id']).school_id == 3
+        # Grades belong to the school of their student
+        assert load_many(Grade, [1, 4]) == [None, load(Grade, 4)]
+        assert load(Grade, 4).student_id in schools[3]['student_ids']
+    finally:
+        context.pop()
+
+
+def test_load_misses_rows_of_another_school_in_the_identity_map(app, schools):
+    context = request_for(app, 3)
+    try:
+        # Already in the session, e.g. loaded by an earlier lookup without the school
+        other = db.session.get(Student, schools[2]['student_ids'][0])
+        assert other is not None and other.school_id == 2
+        assert load(Student, other.id) is None
+    finally:
+        context.pop()
+
+
+def test_load_uses_the_requested_schools_shard(app, schools):
+    # Ids repeat across shards, student 1 is school 1's on the default shard and school 2's on shard_1
+    for school_id in (1, 2):
+        context = request_for(app, school_id)
+        try:
+            assert load(Student, 1).school_id == school_id
+        finally:
+            context.pop()
@@ -0,0 +1,18 @@
+import io
+import zipfile
+
+from project.adapted.sharding import SCHOOL_HEADER
+
+
+def test_school_report_cards_only_include_the_school(client, schools):
+    for school_id in (1, 2, 3):
+        response = client.get('/report_cards/2022-2023', headers={SCHOOL_HEADER: str(school_id)})
+        assert response.status_code == 200
+        assert response.headers['X-Report-Count'] == str(len(schools[school_id]['student_ids']))
+        names = zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+        assert {name.split('/')[0] for name in names} == {f'school_{school_id}'}
+
+
+def test_class_report_cards_from_another_school_are_not_found(client, schools):
+    response = client.get(f'/class/{schools[2]["class_id"]}/report_cards', headers={SCHOOL_HEADER: '3'})
+    assert response.status_code == 404